@@ -1,16 +1,43 @@
 #!/usr/bin/env python3
 
+import bisect
 import cmd
+import codecs
+import collections
+import collections.abc
+import contextlib
+import fnmatch
+import ctypes
+import ctypes.util
+import hashlib
+import heapq
 import json
 import logging
 import os
+import queue
 import re
 import readline
+import select
 import shutil
+import signal
+import socket
+import socketserver
+import sqlite3
+import struct
 import subprocess
 import sys
+import tempfile
 import textwrap
-from functools import wraps
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache, wraps
+from itertools import chain, product
+
+try:
+  import yaml
+except ImportError:
+  yaml = None
 
 
 # Activation de système de log
@@ -19,114 +46,2302 @@ logging.basicConfig(
 )
 
 
-def yml_or_yaml(filename):
-  """Test si un fichier porte l'extension .yml ou .yaml et renvoi son nom complet.
-  Renvoi None si le fichier n'est pas trouvé.
+def yml_or_yaml(filename):
+  """Test si un fichier porte l'extension .yml ou .yaml et renvoi son nom complet.
+  Renvoi None si le fichier n'est pas trouvé.
+
+  Arguments :
+  filename -- le nom d'un fichier sans l'extension
+  """
+  if os.path.isfile(filename + ".yml"):
+    return filename + ".yml"
+  if os.path.isfile(filename + ".yaml"):
+    return filename + ".yaml"
+  return None
+
+
+@lru_cache(maxsize=1 << 18)
+def natural_key(name):
+  """Renvoi la clé de tri naturel d'une chaîne : les nombres sont comparés par leur valeur et la chaîne elle-même
+  départage les noms de même valeur numérique ("a01" et "a1"). Les clés sont mémorisées, les mêmes noms étant triés à
+  chaque affichage.
+
+  Arguments :
+  name -- chaîne de caractères
+  """
+  parts = re_digits.split(name)
+  parts[1::2] = map(int, parts[1::2])
+  return (tuple(parts), name)
+
+
+def sortedn(l):
+  """Trie une liste de chaîne de caractères en tenant compte des nombre
+
+  Exemple :
+    sorted(["a34", "a3", "a52", "a6", "a5"])  => ['a3', 'a34', 'a5', 'a52', 'a6']
+    sortedn(["a34", "a3", "a52", "a6", "a5"]) => ['a3', 'a5', 'a6', 'a34', 'a52']
+
+  Arguments :
+  l -- Liste à trier
+  """
+  return sorted(l, key=natural_key)
+
+
+def group_closure(parents):
+  """Renvoi pour chaque groupe l'ensemble formé du groupe et de tous les groupes dont il dépend.
+
+  Les groupes sont traités dans l'ordre topologique (parents avant enfants) : l'ensemble de chaque groupe est calculé une
+  seule fois, par l'union de ceux de ses parents directs. Les groupes faisant partie d'un cycle sont signalés puis
+  traités par un simple parcours.
+
+  Arguments :
+  parents -- dictionnaire dont la valeur est la liste des parents directs de la clé
+  """
+  nodes = set(parents)
+  for v in parents.values():
+    nodes.update(v)
+  children = {g: [] for g in nodes}
+  indegree = {g: 0 for g in nodes}
+  for g, v in parents.items():
+    for p in set(v):
+      children[p].append(g)
+      indegree[g] += 1
+
+  closure = {}
+  ready = [g for g in nodes if indegree[g] == 0]
+  while ready:
+    g = ready.pop()
+    closure[g] = frozenset((g,)).union(*[closure[p] for p in parents.get(g, ())])
+    for c in children[g]:
+      indegree[c] -= 1
+      if indegree[c] == 0:
+        ready.append(c)
+
+  remaining = nodes - set(closure)
+  if remaining:
+    # Les groupes restants font partie d'un cycle ou en dépendent : seuls ceux qui sont leur propre ancêtre sont signalés
+    def in_cycle(g):
+      seen, todo = set(), [p for p in parents.get(g, ()) if p in remaining]
+      while todo:
+        x = todo.pop()
+        if x == g:
+          return True
+        if x not in seen:
+          seen.add(x)
+          todo.extend(p for p in parents.get(x, ()) if p in remaining)
+      return False
+
+    logging.warning(
+      "Dépendance circulaire entre les groupes : {}".format(", ".join(sortedn(g for g in remaining if in_cycle(g))))
+    )
+    cyclic = {}
+    for g in remaining:
+      members, todo = set(), [g]
+      while todo:
+        x = todo.pop()
+        if x in members:
+          continue
+        if x in closure:
+          members.update(closure[x])
+        else:
+          members.add(x)
+          todo.extend(parents.get(x, ()))
+      cyclic[g] = frozenset(members)
+    closure.update(cyclic)
+
+  return {g: closure[g] for g in parents}
+
+
+def group_members(servers):
+  """Renvoi pour chaque groupe l'ensemble des serveurs qui en font parti, directement ou par l'un de ses sous-groupes.
+
+  Arguments :
+  servers -- dictionnaire des serveurs renvoyé par parse_inventory_file()
+  """
+  members = {}
+  for host, server in servers.items():
+    for group in server.groups:
+      if group in members:
+        members[group].add(host)
+      else:
+        members[group] = {host}
+  return members
+
+
+def reduce_vars(hostvars):
+  """Renvoi les variables d'un serveur conservées en mémoire (celles listées dans 'resident_vars') et l'empreinte de
+  l'ensemble de ses variables.
+
+  Arguments :
+  hostvars -- dictionnaire de toutes les variables du serveur
+  """
+  digest = hashlib.blake2b(json.dumps(hostvars, sort_keys=True, default=str).encode(), digest_size=16).digest()
+  return {k: hostvars[k] for k in resident_vars if k in hostvars}, digest
+
+
+def build_inventory(hosts, parents, hostvars):
+  """Renvoi les serveurs, les groupes et l'index inverse des serveurs de chaque groupe d'un fichier d'inventaire.
+  Les noms de groupes sont internés et les serveurs appartenant aux mêmes groupes, ou ayant les mêmes variables
+  conservées, partagent les mêmes objets.
+
+  Arguments :
+  hosts -- dictionnaire dont la valeur est la liste des groupes directs du serveur
+  parents -- dictionnaire dont la valeur est la liste des parents directs du groupe
+  hostvars -- dictionnaire dont la valeur est le résultat de reduce_vars() pour le serveur
+  """
+  groups = {sys.intern(g): [sys.intern(p) for p in v] for (g, v) in parents.items()}
+  with profiler.timed("group_closure", "parse"):
+    groups_all = group_closure(groups)
+  hostgroups_by_direct = {}
+  shared_vars = {}
+  no_vars = ({}, reduce_vars({})[1])
+  servers = {}
+  for host, direct in hosts.items():
+    direct = frozenset(direct)
+    hostgroups = hostgroups_by_direct.get(direct)
+    if hostgroups is None:
+      hostgroups = frozenset().union(*[groups_all.get(g, ()) for g in direct])
+      hostgroups_by_direct[direct] = hostgroups
+    resident, digest = hostvars.get(host, no_vars)
+    try:
+      resident = shared_vars.setdefault(tuple(sorted(resident.items())), resident)
+    except TypeError:
+      pass
+    servers[sys.intern(host)] = Host(hostgroups, resident, digest)
+  return (servers, groups, group_members(servers))
+
+
+def var_key(value):
+  """Renvoi la forme textuelle d'une valeur de variable, utilisée comme clé par VarIndex et comparée aux prédicats
+
+  Arguments :
+  value -- valeur de la variable
+  """
+  return value if isinstance(value, str) else json.dumps(value, sort_keys=True, default=str)
+
+
+def build_var_index(servers, keys):
+  """Renvoi pour chaque variable de 'keys' son index inverse (VarIndex) sur les serveurs 'servers'
+
+  Arguments :
+  servers -- dictionnaire des serveurs renvoyé par parse_inventory_file()
+  keys -- noms des variables à indexer
+  """
+  index = {}
+  for key in keys:
+    values = {}
+    for host, server in servers.items():
+      if key in server.vars:
+        value = var_key(server.vars[key])
+        if value in values:
+          values[value].add(host)
+        else:
+          values[value] = {host}
+    index[key] = VarIndex(values)
+  return index
+
+
+def check_resident(keys):
+  """Lève une exception ValueError si l'une des variables 'keys' n'est pas conservée en mémoire
+
+  Arguments :
+  keys -- noms des variables
+  """
+  for key in keys:
+    if key not in resident_vars:
+      raise ValueError(
+        "La variable {} n'est pas conservée en mémoire (voir ANSIBLATOR_INDEX_VARS ou ANSIBLATOR_VARS).".format(key)
+      )
+
+
+def parse_predicates(text):
+  """Renvoi la liste des prédicats (variable, opérateur, valeurs) de 'text' ou None si 'text' n'est pas uniquement
+  composé de prédicats séparés par des espaces ou par 'and'.
+
+  Exemple :
+    parse_predicates("env=prod and dc in (par1,par2)") => [('env', '=', ['prod']), ('dc', 'in', ['par1', 'par2'])]
+
+  Arguments :
+  text -- les arguments de la commande
+  """
+  predicates = []
+  text = text.strip()
+  pos = 0
+  while pos < len(text):
+    match = re_predicate.match(text, pos)
+    if not match:
+      return None
+    key, op, op_in, value = match.groups()
+    if op_in:
+      if not value.startswith("("):
+        return None
+      values = [v.strip().strip("'\"") for v in value[1:-1].split(",") if v.strip()]
+    elif value.startswith("("):
+      return None
+    else:
+      values = [value.strip("'\"")]
+    predicates.append((key, op or op_in, values))
+    pos = match.end()
+    match = re_and.match(text, pos)
+    if match:
+      pos = match.end()
+  return predicates or None
+
+
+def expand_range(pattern):
+  """Renvoi la liste des noms décrits par un motif contenant des plages à la façon d'ansible.
+
+  Exemple :
+    expand_range("web[01:03]") => ['web01', 'web02', 'web03']
+    expand_range("db[a:c]-[1:3:2]") => ['dba-1', 'dba-3', 'dbb-1', 'dbb-3', 'dbc-1', 'dbc-3']
+
+  Lève une exception ValueError si un pas est nul ou si le motif décrit plus de 'range_max' noms.
+
+  Arguments :
+  pattern -- motif dont chaque plage est de la forme [début:fin] ou [début:fin:pas]
+  """
+  parts = re_range.split(pattern)
+  ranges = []
+  size = 1
+  for i in range(0, len(parts) - 1, 4):
+    start, end, step = parts[i + 1], parts[i + 2], int(parts[i + 3] or 1)
+    if step <= 0:
+      raise ValueError("le pas de la plage [{}:{}:{}] doit être positif".format(start, end, step))
+    if start.isdigit() and end.isdigit():
+      values = range(int(start), int(end) + 1, step)
+    else:
+      values = range(ord(start), ord(end) + 1, step)
+    size *= len(values)
+    if size > range_max:
+      raise ValueError("le motif {} décrit plus de {} noms".format(pattern, range_max))
+    ranges.append((start, end, values))
+  choices = []
+  for i, (start, end, values) in enumerate(ranges):
+    if start.isdigit() and end.isdigit():
+      width = len(start) if start.startswith("0") else 0
+      values = [str(n).zfill(width) for n in values]
+    else:
+      values = [chr(n) for n in values]
+    choices.append([parts[i * 4]])
+    choices.append(values)
+  choices.append([parts[-1]])
+  return ["".join(c) for c in product(*choices)]
+
+
+def is_host_pattern(pattern):
+  """Indique si 'pattern' est un motif à la façon d'ansible (plages, union, intersection ou exclusion) plutôt qu'une
+  expression régulière.
+
+  Arguments :
+  pattern -- motif saisi par l'utilisateur
+  """
+  if re_range.search(pattern):
+    return True
+  stripped = re.sub(r"\([^)]*\)|\[[^\]]*\]", "", pattern)
+  return ":" in stripped or stripped[:1] in ("&", "!", "~")
+
+
+def match_names(patterns, names):
+  """Renvoi l'ensemble des noms de 'names' correspondant à l'un des motifs de 'patterns'.
+  Les expressions régulières sont regroupées en une seule afin de ne parcourir 'names' qu'une seule fois.
+
+  Arguments :
+  patterns -- liste d'expressions régulières ou de noms contenant des plages
+  names -- ensemble (ou dictionnaire) des noms disponibles
+  """
+  matched = set()
+  regexes = []
+  for pattern in patterns:
+    if re_range.search(pattern):
+      matched.update(n for n in expand_range(pattern) if n in names)
+    elif pattern:
+      regexes.append("(?:{})".format(pattern))
+  if regexes:
+    regex = re.compile("|".join(regexes))
+    matched.update(n for n in names if regex.search(n))
+  return matched
+
+
+def select_hosts(expression, servers, members):
+  """Renvoi l'ensemble des serveurs désignés par une expression à la façon d'ansible.
+
+  Les termes sont séparés par ':' ou ','. Les serveurs des termes simples sont réunis, puis restreints aux serveurs des
+  termes préfixés par '&' et enfin privés de ceux des termes préfixés par '!'. Comme pour ansible, une expression sans
+  terme simple part de tous les serveurs. Un terme peut être un groupe, un serveur, un nom contenant des plages
+  (web[01:50]), un motif avec '*' ou une expression régulière préfixée par '~'.
+
+  Exemple :
+    select_hosts("web:db:&prod:!canary", ...) => serveurs de web ou db, faisant partie de prod, hors canary
+
+  Arguments :
+  expression -- expression à évaluer
+  servers -- dictionnaire des serveurs renvoyé par parse_inventory_file()
+  members -- index des serveurs de chaque groupe renvoyé par group_members()
+  """
+  selected, intersections, exclusions = set(), [], set()
+  # Nombre de termes évalués et de termes simples
+  terms = positive = 0
+  for term in re.split(r"[:,](?![^\[]*\])", expression):
+    operator, atom = (term[0], term[1:]) if term[:1] in ("&", "!") else ("", term)
+    if not atom:
+      continue
+    terms += 1
+    if atom in ("all", "*"):
+      hosts = set(servers)
+    elif atom in members:
+      hosts = members[atom]
+    elif atom in servers:
+      hosts = {atom}
+    else:
+      if atom.startswith("~"):
+        regex = re.compile(atom[1:])
+        names = [n for n in chain(servers, members) if regex.search(n)]
+      elif re_range.search(atom):
+        names = expand_range(atom)
+      else:
+        names = fnmatch.filter(chain(servers, members), atom)
+      hosts = set()
+      for n in names:
+        if n in members:
+          hosts.update(members[n])
+        elif n in servers:
+          hosts.add(n)
+    if operator == "&":
+      intersections.append(hosts)
+    elif operator == "!":
+      exclusions.update(hosts)
+    else:
+      positive += 1
+      selected.update(hosts)
+  if terms and not positive:
+    selected = set(servers)
+  for hosts in intersections:
+    selected &= hosts
+  return selected - exclusions
+
+
+def complete_prefix(names, text):
+  """Renvoi les éléments de la liste triée 'names' commençant par 'text'
+
+  Arguments :
+  names -- liste triée de noms
+  text -- début du nom à compléter
+  """
+  return names[bisect.bisect_left(names, text) : bisect.bisect_left(names, text + "\U0010ffff")]
+
+
+def parse_options(arg, options):
+  """Sépare les options de la forme --nom ou --nom valeur des autres arguments d'une commande.
+  Renvoi un dictionnaire des options rencontrées et la liste des autres arguments.
+  Lève une exception ValueError si une option est inconnue ou si sa valeur est absente.
+
+  Arguments :
+  arg -- les arguments de la commande
+  options -- dictionnaire associant à chaque option acceptée True si elle attend une valeur, False sinon
+  """
+  found, others = {}, []
+  args = arg.split()
+  while args:
+    a = args.pop(0)
+    if not a.startswith("--"):
+      others.append(a)
+    elif a not in options:
+      raise ValueError("Option inconnue : {}".format(a))
+    elif options[a]:
+      if not args:
+        raise ValueError("L'option {} attend une valeur.".format(a))
+      found[a] = args.pop(0)
+    else:
+      found[a] = True
+  return found, others
+
+
+def split_balanced(items, n):
+  """Découpe la liste 'items' en au plus 'n' parties contiguës dont les tailles diffèrent d'au plus un élément
+
+  Arguments :
+  items -- liste à découper
+  n -- nombre de parties
+  """
+  n = max(1, min(n, len(items)))
+  size, extra = divmod(len(items), n)
+  parts, start = [], 0
+  for i in range(n):
+    end = start + size + (1 if i < extra else 0)
+    parts.append(items[start:end])
+    start = end
+  return parts
+
+
+def limit_cover(hosts, members, universe=()):
+  """Renvoi une liste courte de motifs pour --limit désignant exactement l'ensemble 'hosts' : des groupes entiers, les
+  serveurs à exclure de ces groupes ('!serveur') et les serveurs restants. Les groupes sont choisis de façon gloutonne
+  selon le nombre de motifs qu'ils économisent.
+
+  Arguments :
+  hosts -- ensemble des serveurs à désigner
+  members -- dictionnaire des serveurs de chaque groupe
+  universe -- ensemble de tous les serveurs de l'inventaire, utilisable au travers du groupe 'all'
+  """
+  hosts = set(hosts)
+  uncovered = set(hosts)
+  excluded = set()
+  chosen = []
+  candidates = dict(members)
+  if universe:
+    candidates["all"] = universe
+
+  def benefit(group):
+    m = candidates[group]
+    return len(uncovered & m) - len(m - hosts - excluded) - 1
+
+  heap = [(-benefit(g), g) for g in sorted(candidates) if candidates[g] & hosts]
+  heapq.heapify(heap)
+  while heap:
+    stale, group = heapq.heappop(heap)
+    current = benefit(group)
+    if current <= 0:
+      if -stale == current:
+        break
+      continue
+    if -stale != current and heap and current < -heap[0][0]:
+      heapq.heappush(heap, (-current, group))
+      continue
+    chosen.append(group)
+    excluded |= candidates[group] - hosts
+    uncovered -= candidates[group]
+  return chosen + sorted(uncovered) + ["!" + h for h in sorted(excluded)]
+
+
+def env_int(name, default):
+  """Renvoi la valeur entière de la variable d'environnement 'name' ou 'default' si elle est absente ou invalide.
+
+  Arguments :
+  name -- nom de la variable d'environnement
+  default -- valeur renvoyée par défaut
+  """
+  try:
+    return int(os.environ[name])
+  except (KeyError, ValueError):
+    return default
+
+
+def command_label(args):
+  """Renvoi le nom d'une commande enregistré par le profileur : le programme suivi de ses options longues
+
+  Arguments :
+  args -- la commande et ses arguments
+  """
+  return " ".join([args[0]] + [a for a in args[1:] if a.startswith("--")])
+
+
+def run_ansible(*args):
+  """Lance une commande ansible et renvoi sa sortie standard.
+  Lève une exception RuntimeError si la commande se termine en erreur.
+
+  Arguments :
+  args -- la commande et ses arguments
+  """
+  with profiler.timed(command_label(args), "subprocess"):
+    result = subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+  if result.returncode:
+    error = result.stderr.strip().splitlines()
+    raise RuntimeError(
+      "{} a renvoyé le code {}{}".format(args[0], result.returncode, " : " + error[-1] if error else "")
+    )
+  return result.stdout
+
+
+def hash_file(path, h):
+  """Ajoute le contenu du fichier 'path' à l'empreinte 'h'. Un fichier absent est également pris en compte.
+
+  Arguments :
+  path -- chemin du fichier
+  h -- objet hashlib à mettre à jour
+  """
+  h.update(path.encode() + b"\0")
+  try:
+    with open(path, "rb") as fd:
+      for block in iter(lambda: fd.read(1 << 16), b""):
+        h.update(block)
+  except OSError:
+    h.update(b"\1")
+
+
+def hash_tree(path, h):
+  """Ajoute à l'empreinte 'h' le nom, la taille et la date de modification de chaque fichier du dossier 'path'.
+
+  Arguments :
+  path -- chemin du dossier à parcourir
+  h -- objet hashlib à mettre à jour
+  """
+  h.update(path.encode() + b"\0")
+  for root, dirs, files in os.walk(path):
+    dirs.sort()
+    for name in sorted(files):
+      try:
+        st = os.stat(os.path.join(root, name))
+      except OSError:
+        continue
+      h.update("{}\0{}\0{}\0".format(os.path.join(root, name), st.st_size, st.st_mtime_ns).encode())
+
+
+def project_walk(exclude=()):
+  """Parcourt le dossier du projet comme os.walk(".") sans descendre dans le dossier inventory, les dossiers cachés
+  (.git, .ansiblator...) ni les dossiers de 'exclude'
+
+  Arguments :
+  exclude -- noms de dossiers de premier niveau à ignorer
+  """
+  for root, dirs, files in os.walk("."):
+    if root == ".":
+      dirs[:] = [d for d in dirs if not d.startswith(".") and d != "inventory" and d not in exclude]
+    dirs.sort()
+    yield root, dirs, files
+
+
+def hash_project(h, exclude=()):
+  """Ajoute à l'empreinte 'h' le nom, la taille et la date de modification de chaque fichier du projet parcouru par
+  project_walk() : playbooks importés, fichiers de tâches inclus, rôles, ansible.cfg...
+
+  Arguments :
+  h -- objet hashlib à mettre à jour
+  exclude -- noms de dossiers de premier niveau à ignorer
+  """
+  for root, dirs, files in project_walk(exclude):
+    for name in sorted(files):
+      try:
+        st = os.stat(os.path.join(root, name))
+      except OSError:
+        continue
+      h.update("{}\0{}\0{}\0".format(os.path.join(root, name), st.st_size, st.st_mtime_ns).encode())
+
+
+def playbook_fingerprint():
+  """Renvoi l'empreinte de tout ce qui, en dehors du fichier d'inventaire, influe sur son analyse : les fichiers du projet
+  parcourus par le relevé des tags (playbooks importés, fichiers de tâches, rôles), les dossiers group_vars et host_vars
+  et la liste des variables conservées en mémoire.
+  """
+  h = hashlib.sha256(",".join(resident_vars).encode())
+  hash_project(h)
+  for tree in ("inventory/group_vars", "inventory/host_vars"):
+    hash_tree(tree, h)
+  return h.hexdigest()
+
+
+def deploy_fingerprint():
+  """Renvoi l'empreinte du projet en dehors des inventaires (playbooks, rôles, fichiers de tâches, ansible.cfg...),
+  commune aux empreintes de déploiement de tous les serveurs. Les dossiers group_vars et host_vars n'en font pas partie :
+  ils sont déjà pris en compte par l'empreinte des variables de chaque serveur.
+  """
+  h = hashlib.sha256()
+  hash_project(h, exclude=("group_vars", "host_vars"))
+  return h.hexdigest()
+
+
+def is_dynamic_inventory(inventory_path):
+  """Indique si le fichier d'inventaire est une source dynamique : script exécutable ou fichier YAML de configuration
+  d'un plugin d'inventaire (clé 'plugin')
+
+  Arguments :
+  inventory_path -- fichier d'inventaire
+  """
+  if os.access(inventory_path, os.X_OK):
+    return True
+  if not inventory_path.endswith((".yml", ".yaml")):
+    return False
+  try:
+    with open(inventory_path, errors="replace") as fd:
+      return any(re.match(r"plugin\s*:", line) for line in fd)
+  except OSError:
+    return False
+
+
+def inventory_fingerprint(inventory_path, base):
+  """Renvoi l'empreinte d'un fichier d'inventaire. Celle d'une source dynamique change en plus toutes les 'dynamic_ttl'
+  secondes, ou à chaque appel si 'dynamic_ttl' vaut 0, afin que ses serveurs soient relus.
+
+  Arguments :
+  inventory_path -- fichier d'inventaire
+  base -- empreinte commune renvoyée par playbook_fingerprint()
+  """
+  h = hashlib.sha256(base.encode())
+  hash_file(inventory_path, h)
+  if is_dynamic_inventory(inventory_path):
+    h.update("\0{}".format(int(time.time() // dynamic_ttl) if dynamic_ttl else time.time()).encode())
+  return h.hexdigest()
+
+
+def remove_files(paths):
+  """Supprime les fichiers 'paths', en ignorant ceux qui n'existent plus
+
+  Arguments :
+  paths -- chemins des fichiers à supprimer
+  """
+  for path in paths:
+    try:
+      os.remove(path)
+    except OSError:
+      pass
+
+
+def state_load(f):
+  """Renvoi l'empreinte enregistrée pour chaque serveur du fichier d'inventaire 'f' lors de son dernier déploiement réussi
+
+  Arguments :
+  f -- nom du fichier dans le dossier inventory
+  """
+  try:
+    with open(os.path.join(state_dir, f + ".json")) as fd:
+      return json.load(fd)
+  except (OSError, ValueError):
+    return {}
+
+
+def state_update(f, fingerprints):
+  """Ajoute les empreintes 'fingerprints' des serveurs déployés avec succès à l'état du fichier d'inventaire 'f'
+
+  Arguments :
+  f -- nom du fichier dans le dossier inventory
+  fingerprints -- dictionnaire serveur -> empreinte
+  """
+  with state_lock:
+    state = state_load(f)
+    state.update(fingerprints)
+    try:
+      os.makedirs(state_dir, exist_ok=True)
+      tmp_path = os.path.join(state_dir, "{}.{}.tmp".format(f, os.getpid()))
+      with open(tmp_path, "w") as fd:
+        json.dump(state, fd)
+      os.replace(tmp_path, os.path.join(state_dir, f + ".json"))
+    except OSError as e:
+      logging.warning("Impossible d'écrire l'état des déploiements dans {} : {}".format(state_dir, e))
+
+
+def history_connect():
+  """Renvoi une connexion à l'historique des déploiements, créé au besoin"""
+  os.makedirs(os.path.dirname(history_db), exist_ok=True)
+  db = sqlite3.connect(history_db, timeout=30)
+  db.executescript(
+    """
+    CREATE TABLE IF NOT EXISTS runs (
+      id INTEGER PRIMARY KEY, inventory TEXT, name TEXT, argv TEXT, started REAL, finished REAL, returncode INTEGER,
+      interrupted INTEGER
+    );
+    CREATE TABLE IF NOT EXISTS tasks (
+      run INTEGER, seq INTEGER, play TEXT, task TEXT, tags TEXT, started REAL, duration REAL
+    );
+    CREATE TABLE IF NOT EXISTS results (run INTEGER, seq INTEGER, host TEXT, status TEXT, duration REAL);
+    CREATE INDEX IF NOT EXISTS tasks_run ON tasks (run);
+    CREATE INDEX IF NOT EXISTS results_run ON results (run, host);
+    """
+  )
+  return db
+
+
+def history_record(f, run, task_tags):
+  """Ajoute à l'historique la durée et le résultat de chaque tâche et de chaque serveur d'un déploiement terminé
+
+  Arguments :
+  f -- nom du fichier d'inventaire déployé
+  run -- le DeployRun terminé
+  task_tags -- dictionnaire nom de tâche -> tags (voir TagIndexer)
+  """
+  try:
+    with contextlib.closing(history_connect()) as db, db:
+      run_id = db.execute(
+        "INSERT INTO runs (inventory, name, argv, started, finished, returncode, interrupted) VALUES (?, ?, ?, ?, ?, ?, ?)",
+        (f, run.name, " ".join(run.argv), run.started, run.finished, run.returncode, int(run.interrupted)),
+      ).lastrowid
+      for seq, (play, task, started, duration, results) in enumerate(run.timings):
+        db.execute(
+          "INSERT INTO tasks VALUES (?, ?, ?, ?, ?, ?, ?)",
+          (run_id, seq, play, task, ",".join(sorted(task_tags.get(task, ()))), started, duration),
+        )
+        db.executemany(
+          "INSERT INTO results VALUES (?, ?, ?, ?, ?)",
+          [(run_id, seq, host, status, host_duration) for (host, (status, host_duration)) in results.items()],
+        )
+  except sqlite3.Error as e:
+    logging.warning("Impossible d'écrire l'historique des déploiements dans {} : {}".format(history_db, e))
+
+
+def cache_load(key):
+  """Renvoi les serveurs, groupes, membres des groupes et tags enregistrés dans le cache pour l'empreinte 'key' ou None
+  s'ils sont absents.
+
+  Arguments :
+  key -- empreinte du fichier d'inventaire
+  """
+  path = os.path.join(cache_dir, key + ".json")
+  try:
+    with open(path) as fd:
+      data = json.load(fd)
+    os.utime(path)
+    # Les groupes de chaque serveur sont enregistrés en entier : ils sont leurs propres groupes directs
+    hosts = {h: s["groups"] for (h, s) in data["servers"].items()}
+    hostvars = {h: (s["vars"], bytes.fromhex(s["digest"])) for (h, s) in data["servers"].items()}
+    servers, groups, members = build_inventory(hosts, data["groups"], hostvars)
+  except (OSError, ValueError, KeyError, TypeError):
+    return None
+  return (servers, groups, members, set(data["tags"]))
+
+
+def cache_save(key, servers, groups, tags):
+  """Enregistre dans le cache les serveurs, groupes et tags d'un fichier d'inventaire puis supprime les entrées les plus
+  anciennes au-delà de 'cache_size'.
+
+  Arguments :
+  key -- empreinte du fichier d'inventaire
+  servers, groups, tags -- le résultat de l'analyse du fichier d'inventaire
+  """
+  data = {
+    "servers": {
+      h: {"vars": s.vars, "groups": sorted(s.groups), "digest": s.digest.hex()} for (h, s) in servers.items()
+    },
+    "groups": groups,
+    "tags": sorted(tags),
+  }
+  try:
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp_path = os.path.join(cache_dir, "{}.{}.tmp".format(key, os.getpid()))
+    with open(tmp_path, "w") as fd:
+      json.dump(data, fd)
+    os.replace(tmp_path, os.path.join(cache_dir, key + ".json"))
+    entries = [os.path.join(cache_dir, e) for e in os.listdir(cache_dir) if e.endswith(".json")]
+    entries.sort(key=lambda e: os.stat(e).st_mtime, reverse=True)
+    for entry in entries[cache_size:]:
+      os.remove(entry)
+  except OSError as e:
+    logging.warning("Impossible d'écrire dans le cache {} : {}".format(cache_dir, e))
+
+
+def setup_fingerprint(requirements_file):
+  """Renvoi l'empreinte des fichiers décrivant l'installation des rôles et collections et celle du dossier roles
+
+  Arguments :
+  requirements_file -- chemin du fichier requirements ou None
+  """
+  inputs = hashlib.sha256()
+  hash_file("setup_env.sh", inputs)
+  hash_file(requirements_file or "requirements.yml", inputs)
+  inputs.update((galaxy_server or "").encode())
+  roles = hashlib.sha256()
+  hash_tree("roles", roles)
+  return {"inputs": inputs.hexdigest(), "roles": roles.hexdigest()}
+
+
+def setup_is_current(fingerprint):
+  """Indique si le fichier de verrou correspond à l'empreinte 'fingerprint' (l'installation peut alors être sautée)"""
+  try:
+    with open(setup_lock) as fd:
+      return json.load(fd) == fingerprint
+  except (OSError, ValueError):
+    return False
+
+
+def setup_lock_save(requirements_file):
+  """Enregistre dans le fichier de verrou l'empreinte de l'installation qui vient de réussir"""
+  try:
+    os.makedirs(os.path.dirname(setup_lock), exist_ok=True)
+    with open(setup_lock, "w") as fd:
+      json.dump(setup_fingerprint(requirements_file), fd)
+  except OSError as e:
+    logging.warning("Impossible d'écrire le fichier {} : {}".format(setup_lock, e))
+
+
+def galaxy_requirements(requirements_file):
+  """Renvoi la liste des couples (type, fichier requirements) à installer indépendamment : les rôles et les collections
+  d'un même fichier sont séparés, ansible-galaxy n'installant pas les collections lorsque le dossier des rôles est
+  imposé. Renvoi [("roles", requirements_file)] si le fichier ne contient pas de collections ou ne peut pas être lu.
+
+  Arguments :
+  requirements_file -- chemin du fichier requirements
+  """
+  if yaml is None:
+    return [("roles", requirements_file)]
+  try:
+    with open(requirements_file) as fd:
+      data = yaml.safe_load(fd)
+  except (OSError, yaml.YAMLError):
+    return [("roles", requirements_file)]
+  if not isinstance(data, dict) or not data.get("collections"):
+    return [("roles", requirements_file)]
+  os.makedirs(".ansiblator", exist_ok=True)
+  files = []
+  for kind in ("roles", "collections"):
+    if data.get(kind):
+      with tempfile.NamedTemporaryFile("w", dir=".ansiblator", prefix="requirements.", suffix=".yml", delete=False) as fd:
+        yaml.safe_dump({kind: data[kind]}, fd)
+        files.append((kind, fd.name))
+  return files
+
+
+def galaxy_install(requirements_file):
+  """Installe les rôles du fichier requirements dans le dossier roles et ses collections, en parallèle avec deux
+  processus ansible-galaxy distincts. Les rôles sont installés par un seul processus afin que deux rôles ayant une
+  dépendance commune ne l'installent pas en même temps. Renvoi 0 si toutes les installations ont réussi.
+
+  Arguments :
+  requirements_file -- chemin du fichier requirements
+  """
+  files = galaxy_requirements(requirements_file)
+
+  def install(kind_and_file):
+    kind, f = kind_and_file
+    if kind == "collections":
+      requirements_cmd = ["ansible-galaxy", "collection", "install", "-r", f, "-f"]
+    else:
+      requirements_cmd = ["ansible-galaxy", "install", "-p", "./roles", "-r", f, "-f"]
+    if galaxy_server:
+      requirements_cmd += ["--server", galaxy_server]
+    logging.debug(
+      "Lancement du chargement des roles et collections avec la commande {}".format(" ".join(requirements_cmd))
+    )
+    with profiler.timed(command_label(requirements_cmd), "subprocess", file=f):
+      return subprocess.run(requirements_cmd).returncode
+
+  try:
+    with ThreadPoolExecutor(max_workers=galaxy_jobs) as executor:
+      # Le premier code non nul est renvoyé, y compris négatif pour une installation tuée par un signal
+      return next((code for code in executor.map(install, files) if code), 0)
+  finally:
+    for _, f in files:
+      if f != requirements_file:
+        os.remove(f)
+
+
+def inotify_open(paths):
+  """Renvoi un descripteur inotify surveillant les dossiers 'paths' ou None si inotify n'est pas disponible.
+
+  Arguments :
+  paths -- liste des dossiers à surveiller
+  """
+  # IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+  mask = 0x002 | 0x004 | 0x008 | 0x040 | 0x080 | 0x100 | 0x200
+  try:
+    libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+    fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+  except (OSError, AttributeError):
+    return None
+  if fd < 0:
+    return None
+  for path in paths:
+    libc.inotify_add_watch(fd, os.fsencode(path), mask)
+  return fd
+
+
+def inotify_drain(fd):
+  """Vide la file d'évènements du descripteur inotify 'fd'"""
+  try:
+    while os.read(fd, 1 << 16):
+      pass
+  except BlockingIOError:
+    pass
+
+
+if yaml:
+
+  class AnsibleYamlLoader(yaml.SafeLoader):
+    """Chargeur YAML ignorant les balises propres à ansible (!vault, !unsafe...)"""
+
+  AnsibleYamlLoader.add_multi_constructor("!", lambda loader, suffix, node: None)
+
+
+# Fichier de verrou de l'installation des rôles et collections, nombre d'installations ansible-galaxy (rôles et
+# collections) lancées en parallèle et serveur Galaxy à utiliser à la place du serveur par défaut
+setup_lock = os.path.join(".ansiblator", "setup.lock")
+galaxy_jobs = max(1, env_int("ANSIBLATOR_GALAXY_JOBS", 4))
+galaxy_server = os.environ.get("ANSIBLATOR_GALAXY_SERVER")
+
+# Journaux des déploiements et nombre maximum de processus ansible-playbook lancés en parallèle
+logs_dir = os.path.join(".ansiblator", "logs")
+deploy_jobs = max(1, env_int("ANSIBLATOR_DEPLOY_JOBS", 4))
+
+# Historique de la durée des tâches et des serveurs de chaque déploiement (commande history)
+history_db = os.path.join(".ansiblator", "history.db")
+
+# Une tâche est signalée par 'history regressions' lorsqu'elle est plus lente que sa moyenne passée d'au moins ce
+# rapport et de ce nombre de secondes
+history_regression_ratio = 1.5
+history_regression_delay = 1.0
+
+# Empreinte de chaque serveur lors de son dernier déploiement réussi (deploy --changed-only)
+state_dir = os.path.join(".ansiblator", "state")
+# Les déploiements parallèles d'un même fichier d'inventaire mettent à jour son état l'un après l'autre
+state_lock = threading.Lock()
+
+# Longueur maximale du motif --limit au-delà de laquelle il est passé dans un fichier (@fichier)
+limits_dir = os.path.join(".ansiblator", "limits")
+limit_max = max(1, env_int("ANSIBLATOR_LIMIT_MAX", 4096))
+
+# Variables des serveurs conservées en mémoire, les autres sont relues à la demande
+# Variables indexées, interrogeables par les prédicats de list, add et remove (elles sont toujours conservées en mémoire)
+# et colonnes affichées par défaut par list
+index_vars = [v for v in os.environ.get("ANSIBLATOR_INDEX_VARS", "env").split(",") if v]
+list_columns = [v for v in os.environ.get("ANSIBLATOR_LIST_COLUMNS", "env").split(",") if v]
+resident_vars = [v for v in os.environ.get("ANSIBLATOR_VARS", "env").split(",") if v]
+resident_vars += [v for v in index_vars + list_columns if v not in resident_vars]
+
+# Prédicat sur une variable des serveurs : env=prod, os_version>=12, datacenter in (par1,par2)
+re_predicate = re.compile(r"(\w+)(?:\s*(!=|>=|<=|=|>|<)\s*|\s+(in)\s*)(\([^)]*\)|[^\s()]+)")
+re_and = re.compile(r"\s+and\s+|\s+")
+
+# Découpage des noms en parties textuelles et numériques pour le tri naturel
+re_digits = re.compile(r"(\d+)")
+
+# Plage de noms à la façon d'ansible : [01:50], [a:f] ou [0:100:10]
+re_range = re.compile(r"\[([0-9]+|[a-zA-Z]):([0-9]+|[a-zA-Z])(?::([0-9]+))?\]")
+# Nombre maximum de noms décrits par un motif contenant des plages
+range_max = max(1, env_int("ANSIBLATOR_RANGE_MAX", 100000))
+
+# Nombre maximum de fichiers d'inventaire analysés en parallèle (chaque analyse lance des processus ansible)
+reload_jobs = max(1, env_int("ANSIBLATOR_JOBS", min(8, os.cpu_count() or 1)))
+
+# Chargement des inventaires par la commande ansible-inventory ('subprocess') ou par l'API python d'ansible ('python')
+inventory_backend = os.environ.get("ANSIBLATOR_BACKEND", "subprocess")
+
+# Extraction des tags directement depuis les fichiers du playbook plutôt qu'avec ansible-playbook --list-tags
+static_tags_enabled = env_int("ANSIBLATOR_STATIC_TAGS", 1) > 0
+
+# Cache des inventaires analysés, conservé entre deux lancements
+cache_dir = os.path.join(".ansiblator", "cache")
+cache_size = max(1, env_int("ANSIBLATOR_CACHE_SIZE", 64))
+# Durée de validité en secondes de l'analyse des sources d'inventaire dynamiques (scripts, configurations de plugin),
+# dont le contenu ne change pas avec les serveurs. 0 pour ne pas les mettre en cache et les réanalyser à chaque
+# rechargement.
+dynamic_ttl = max(0, env_int("ANSIBLATOR_DYNAMIC_TTL", 300))
+
+# Mesure du coût des commandes, des chargements et des processus ansible (commande stats)
+profile_enabled = env_int("ANSIBLATOR_PROFILE", 0) > 0
+profile_export = os.environ.get("ANSIBLATOR_PROFILE_EXPORT")
+
+# Socket du démon partageant les inventaires entre plusieurs sessions
+daemon_socket = os.path.join(".ansiblator", "daemon.sock")
+
+# Surveillance des fichiers d'inventaire entre deux commandes
+watch_enabled = env_int("ANSIBLATOR_WATCH", 0) > 0
+watch_interval = max(1, env_int("ANSIBLATOR_WATCH_INTERVAL", 2))
+
+def check_prerequisites():
+  """Vérifie qu'ansible est installé et que le dossier courant contient un playbook et des inventaires, sinon quitte"""
+  # Test si ansible est installé
+  if not shutil.which("ansible-playbook"):
+    logging.critical("'ansible-playbook' est absent. Vous devez d'abord installer ansible.")
+    exit(1)
+  elif not shutil.which("ansible-inventory"):
+    logging.critical("'ansible-inventory' est absent. Vous devez d'abord installer ansible.")
+    exit(1)
+
+  # Test de tous les prérequis :
+  # - le fichier main.yaml existe et est accessible en lecture
+  # - le dossier inventory existe et n'est pas vide
+  playbook_file = yml_or_yaml("main")
+  if not playbook_file:
+    logging.critical("Aucun fichier main.yml ou main.yaml n'a été trouvé.")
+    exit(1)
+  elif not os.access(playbook_file, os.R_OK):
+    logging.critical("Le fichier {} ne peut pas être lu.".format(playbook_file))
+    exit(1)
+  elif not (
+    os.path.isdir("inventory")
+    and os.access("inventory", os.R_OK)
+    and os.access("inventory", os.X_OK)
+    and len(os.listdir("inventory")) >= 1
+  ):
+    logging.critical("Le dossier inventory n'existe pas.")
+    exit(1)
+
+
+def setup_roles():
+  """Installe les rôles et collections avec setup_env.sh ou le fichier requirements, sauf si rien n'a changé depuis la
+  dernière installation réussie. Quitte en cas d'erreur.
+  """
+  # Chargement des rôles et collections avec le fichier setup_env.sh s'il existe
+  # Sinon, chargement des rôles et collections à partir du requirements.yaml
+  # Rien n'est relancé si ces fichiers et le dossier roles n'ont pas changé depuis la dernière installation réussie
+  requirements_file = yml_or_yaml("requirements")
+  run_setup_env_nok = 1
+  run_requirements_nok = 1
+
+  if setup_is_current(setup_fingerprint(requirements_file)):
+    logging.debug("Rôles et collections à jour d'après {}, installation ignorée.".format(setup_lock))
+    run_setup_env_nok = 0
+  elif os.path.isfile("setup_env.sh") and os.access("setup_env.sh", os.R_OK):
+    logging.debug("Lancement de setup_env.sh.")
+    with profiler.timed("sh setup_env.sh", "subprocess"):
+      run_setup_env_nok = subprocess.run(["sh", "setup_env.sh"]).returncode
+    logging.debug("setup_env.sh a été lancé et la valeur de sortie obtenu est {}".format(run_setup_env_nok))
+    if not run_setup_env_nok:
+      setup_lock_save(requirements_file)
+  else:
+    logging.debug("Le fichier setup_env.sh n'existe pas ou n'est pas lisible.")
+
+  if run_setup_env_nok:
+    if not shutil.which("ansible-galaxy"):
+      logging.critical("ansible-galaxy ne semble pas présent")
+      exit(1)
+    if requirements_file and os.access(requirements_file, os.R_OK):
+      run_requirements_nok = galaxy_install(requirements_file)
+      logging.debug("ansible-galaxy a été lancé et la valeur de sortie obtenu est {}".format(run_requirements_nok))
+      if run_requirements_nok:
+        logging.critical("Le chargement des rôles et collections depuis le fichier requirements a rencontré une erreur.")
+        exit(1)
+      setup_lock_save(requirements_file)
+    else:
+      logging.warning("Le fichier requirements.yaml (ou .yml) n'existe pas ou n'est pas lisible.")
+
+
+# Définition de la classe mesurant le coût des sections de code
+class Profiler:
+  """Mesure la durée, le temps CPU et la variation de mémoire résidente de sections de code. Lorsqu'il est désactivé,
+  timed() renvoi un contexte vide et ne coûte presque rien."""
+
+  null = contextlib.nullcontext()
+
+  def __init__(self, enabled=False, size=10000):
+    self.enabled = enabled
+    self.records = collections.deque(maxlen=size)
+    self.epoch = time.perf_counter()
+
+  @staticmethod
+  def rss():
+    """Renvoi la mémoire résidente du processus en octets ou None si elle ne peut pas être lue"""
+    try:
+      with open("/proc/self/statm") as fd:
+        return int(fd.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+      return None
+
+  def timed(self, name, cat, **args):
+    """Renvoi le contexte mesurant la section 'name'
+
+    Arguments :
+    name -- nom de la section
+    cat -- catégorie de la section (command, reload, parse, subprocess...)
+    args -- informations complémentaires enregistrées avec la mesure (fichier d'inventaire...)
+    """
+    if not self.enabled:
+      return self.null
+    return self.section(name, cat, args)
+
+  @contextlib.contextmanager
+  def section(self, name, cat, args):
+    """Contexte enregistrant une mesure dans 'records'"""
+    rss, cpu, start = self.rss(), time.thread_time(), time.perf_counter()
+    try:
+      yield
+    finally:
+      wall, cpu = time.perf_counter() - start, time.thread_time() - cpu
+      end_rss = self.rss()
+      self.records.append(
+        {
+          "name": name,
+          "cat": cat,
+          "args": args,
+          "start": start - self.epoch,
+          "wall": wall,
+          "cpu": cpu,
+          "rss": end_rss - rss if rss is not None and end_rss is not None else None,
+          "thread": threading.get_ident(),
+        }
+      )
+
+  def export(self, path):
+    """Écrit les mesures dans le fichier 'path' au format Chrome trace (extension .json) ou en JSON lines
+
+    Arguments :
+    path -- chemin du fichier
+    """
+    records = list(self.records)
+    with open(path, "w") as fd:
+      if path.endswith(".json"):
+        events = [
+          {
+            "name": r["name"],
+            "cat": r["cat"],
+            "ph": "X",
+            "ts": r["start"] * 1e6,
+            "dur": r["wall"] * 1e6,
+            "pid": os.getpid(),
+            "tid": r["thread"],
+            "args": dict(r["args"], cpu=r["cpu"], rss=r["rss"]),
+          }
+          for r in records
+        ]
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, fd)
+      else:
+        for r in records:
+          fd.write(json.dumps(r) + "\n")
+    return len(records)
+
+
+profiler = Profiler(profile_enabled)
+
+
+# Définition de la classe lisant un document JSON au fil de l'eau
+class JsonStream:
+  """Lit un document JSON depuis un flux binaire sans le charger entièrement : les objets sont parcourus clé par clé et
+  seules les valeurs demandées sont décodées."""
+
+  decoder = json.JSONDecoder()
+  re_ws = re.compile(r"[ \t\n\r]*")
+  # Caractères pouvant prolonger un nombre : '12.' ou '1e' coupés en fin de tampon
+  re_number_tail = re.compile(r"[0-9.eE+-]*")
+
+  def __init__(self, fd, chunk_size=1 << 16):
+    self.fd = fd
+    self.chunk_size = chunk_size
+    self.buf = ""
+    self.pos = 0
+    self.eof = False
+    self.incremental = codecs.getincrementaldecoder("utf-8")()
+
+  def fill(self, size=None):
+    """Ajoute au tampon le bloc suivant du flux. Renvoi False si la fin du flux est atteinte.
+
+    Arguments :
+    size -- nombre d'octets à lire
+    """
+    if self.eof:
+      return False
+    data = self.fd.read(size or self.chunk_size)
+    self.eof = not data
+    self.buf = self.buf[self.pos :] + self.incremental.decode(data, final=self.eof)
+    self.pos = 0
+    return not self.eof
+
+  def peek(self):
+    """Renvoi le prochain caractère significatif sans le consommer"""
+    while True:
+      self.pos = self.re_ws.match(self.buf, self.pos).end()
+      if self.pos < len(self.buf):
+        return self.buf[self.pos]
+      if not self.fill():
+        raise ValueError("Fin inattendue du document JSON")
+
+  def expect(self, char):
+    """Consomme le caractère 'char' ou lève une exception ValueError si le document contient autre chose"""
+    found = self.peek()
+    if found != char:
+      raise ValueError("'{}' attendu dans le document JSON à la place de '{}'".format(char, found))
+    self.pos += 1
+
+  def value(self):
+    """Décode et renvoi la valeur suivante"""
+    self.peek()
+    size = self.chunk_size
+    while True:
+      try:
+        value, end = self.decoder.raw_decode(self.buf, self.pos)
+        # Un nombre suivi uniquement de caractères pouvant le prolonger jusqu'à la fin du tampon peut être incomplet
+        incomplete = (
+          isinstance(value, (int, float))
+          and not isinstance(value, bool)
+          and self.re_number_tail.fullmatch(self.buf, end) is not None
+        )
+        if not incomplete or self.eof:
+          self.pos = end
+          return value
+      except ValueError:
+        if self.eof:
+          raise
+      # Les lectures grossissent afin de ne pas décoder trop souvent le début d'une grande valeur
+      self.fill(size)
+      size *= 2
+
+  def items(self):
+    """Parcourt l'objet suivant et renvoi chacune de ses clés. La valeur associée doit être consommée par l'appelant
+    (avec value() ou items()) avant de passer à la clé suivante."""
+    self.expect("{")
+    if self.peek() == "}":
+      self.pos += 1
+      return
+    while True:
+      key = self.value()
+      self.expect(":")
+      yield key
+      char = self.peek()
+      self.pos += 1
+      if char == "}":
+        return
+      if char != ",":
+        raise ValueError("',' ou '}}' attendu dans le document JSON à la place de '{}'".format(char))
+
+
+# Définition de la classe extrayant les tags du playbook
+class TagIndexer:
+  """Parcourt le playbook, les playbooks importés, les rôles et les fichiers de tâches inclus afin de relever tous les tags
+  utilisés, sans lancer ansible-playbook. Le contenu de chaque fichier YAML est conservé tant que sa date de modification
+  ne change pas.
+  """
+
+  cache = {}
+  cache_lock = threading.Lock()
+  includes = ("include_tasks", "import_tasks", "include")
+  role_includes = ("include_role", "import_role")
+  sections = ("pre_tasks", "tasks", "post_tasks")
+  # Mots-clés d'une tâche qui ne sont pas le nom de son module
+  keywords = frozenset(
+    (
+      "tags", "when", "register", "loop", "loop_control", "vars", "become", "become_user", "notify", "ignore_errors",
+      "changed_when", "failed_when", "delegate_to", "run_once", "with_items", "with_dict", "until", "retries", "delay",
+      "args", "environment", "no_log", "check_mode", "diff", "listen", "any_errors_fatal", "throttle",
+    )
+  )
+
+  def __init__(self, playbook):
+    self.base_dir = os.path.dirname(os.path.abspath(playbook))
+    self.playbook_file = playbook
+    self.tags = set()
+    self.task_tags = {}
+    self.dynamic = []
+    self.seen = set()
+
+  @classmethod
+  def load(cls, path):
+    """Renvoi le contenu du fichier YAML 'path', relu uniquement si sa date de modification a changé
+
+    Arguments :
+    path -- chemin du fichier
+    """
+    mtime = os.stat(path).st_mtime_ns
+    with cls.cache_lock:
+      if path in cls.cache and cls.cache[path][0] == mtime:
+        return cls.cache[path][1]
+    with open(path) as fd:
+      data = yaml.load(fd, Loader=AnsibleYamlLoader)
+    with cls.cache_lock:
+      cls.cache[path] = (mtime, data)
+    return data
+
+  @staticmethod
+  def module(task, names):
+    """Renvoi le nom court et l'argument du premier module de 'names' utilisé par la tâche, éventuellement préfixé par
+    ansible.builtin ou ansible.legacy"""
+    for name in names:
+      for prefix in ("", "ansible.builtin.", "ansible.legacy."):
+        if prefix + name in task:
+          return name, task[prefix + name]
+    return None, None
+
+  def run(self):
+    """Renvoi l'ensemble des tags du playbook ou None si certaines inclusions n'ont pas pu être résolues"""
+    self.playbook(self.playbook_file)
+    if self.dynamic:
+      logging.debug("Inclusions non résolues lors de l'extraction des tags : {}".format(", ".join(self.dynamic)))
+      return None
+    return self.tags
+
+  def add_tags(self, value):
+    """Ajoute les tags d'un élément (chaîne séparée par des virgules ou liste) et les renvoi"""
+    found = set()
+    if not value:
+      return found
+    for tag in value.split(",") if isinstance(value, str) else value:
+      tag = str(tag).strip()
+      if "{{" in tag:
+        self.dynamic.append(tag)
+      elif tag:
+        found.add(tag)
+    self.tags |= found
+    return found
+
+  def resolve(self, name, *dirs):
+    """Renvoi le chemin du premier fichier 'name' trouvé dans 'dirs' ou None. Les noms dynamiques ne sont pas résolus."""
+    if not isinstance(name, str) or "{{" in name:
+      self.dynamic.append(str(name))
+      return None
+    for d in dirs:
+      path = os.path.join(d, name)
+      if os.path.isfile(path):
+        return path
+    self.dynamic.append(name)
+    return None
+
+  def visit(self, *key):
+    """Indique si le fichier (et le contexte) 'key' doit être parcouru (il ne l'a pas encore été)"""
+    if key[0] is None or key in self.seen:
+      return False
+    self.seen.add(key)
+    return True
+
+  @staticmethod
+  def sequence(value, path):
+    """Renvoi la liste 'value' (vide pour None). Lève une exception TypeError si le fichier 'path' n'a pas la structure
+    attendue par ansible (liste de jeux, de rôles ou de tâches)."""
+    if value is None:
+      return ()
+    if not isinstance(value, list):
+      raise TypeError("{} : liste attendue à la place de {}".format(path, type(value).__name__))
+    return value
+
+  @classmethod
+  def task_name(cls, task, role):
+    """Renvoi le nom d'une tâche tel qu'affiché par ansible-playbook ('rôle : nom' pour les tâches d'un rôle)"""
+    name = task.get("name")
+    if not name:
+      name = next((k for k in task if k not in cls.keywords), "")
+    return "{} : {}".format(role, name) if role else str(name)
+
+  def playbook(self, path):
+    """Parcourt un playbook"""
+    if not self.visit(path):
+      return
+    for play in self.sequence(self.load(path), path):
+      if not isinstance(play, dict):
+        continue
+      _, target = self.module(play, ("import_playbook", "include"))
+      if target:
+        self.playbook(self.resolve(target, os.path.dirname(path)))
+        continue
+      inherited = frozenset(self.add_tags(play.get("tags")))
+      for role in self.sequence(play.get("roles"), path):
+        role_tags = inherited
+        if isinstance(role, dict):
+          role_tags = inherited | self.add_tags(role.get("tags"))
+          role = role.get("role") or role.get("name")
+        self.role(role, os.path.dirname(path), inherited=role_tags)
+      for section in self.sections:
+        self.tasks(play.get(section), os.path.dirname(path), inherited)
+
+  def role(self, name, playbook_dir, tasks_from="main", inherited=frozenset()):
+    """Parcourt les dépendances et les tâches d'un rôle"""
+    if not isinstance(name, str) or "{{" in name:
+      self.dynamic.append(str(name))
+      return
+    # Les rôles galaxy installés dans roles sont nommés auteur.rôle : le dossier local est cherché avant de considérer le
+    # nom comme celui d'un rôle de collection, qui n'est pas recherché
+    role_dir = next(
+      (d for d in (os.path.join(playbook_dir, "roles", name), os.path.join(self.base_dir, "roles", name)) if os.path.isdir(d)),
+      None,
+    )
+    if role_dir is None:
+      self.dynamic.append(name)
+      return
+    meta = yml_or_yaml(os.path.join(role_dir, "meta", "main"))
+    if tasks_from == "main" and self.visit(meta, inherited):
+      for dependency in self.sequence((self.load(meta) or {}).get("dependencies"), meta):
+        dependency_tags = inherited
+        if isinstance(dependency, dict):
+          dependency_tags = inherited | self.add_tags(dependency.get("tags"))
+          dependency = dependency.get("role") or dependency.get("name")
+        self.role(dependency, playbook_dir, inherited=dependency_tags)
+    if tasks_from.endswith((".yml", ".yaml")):
+      tasks_from = os.path.splitext(tasks_from)[0]
+    tasks = yml_or_yaml(os.path.join(role_dir, "tasks", tasks_from))
+    if tasks is None:
+      if tasks_from != "main":
+        self.dynamic.append("{}/tasks/{}".format(name, tasks_from))
+      return
+    if self.visit(tasks, inherited, name):
+      self.tasks(self.load(tasks), os.path.dirname(tasks), inherited, name)
+
+  def tasks(self, tasks, task_dir, inherited=frozenset(), role=None):
+    """Parcourt une liste de tâches en relevant pour chacune les tags hérités du jeu, du rôle et des blocs"""
+    for task in self.sequence(tasks, task_dir):
+      if not isinstance(task, dict):
+        continue
+      effective = inherited | self.add_tags(task.get("tags"))
+      if any(section in task for section in ("block", "rescue", "always")):
+        for section in ("block", "rescue", "always"):
+          self.tasks(task.get(section), task_dir, effective, role)
+        continue
+      _, target = self.module(task, self.includes)
+      if target is not None:
+        if isinstance(target, dict):
+          target = target.get("file")
+        path = self.resolve(target, task_dir, self.base_dir)
+        if self.visit(path, effective, role):
+          self.tasks(self.load(path), os.path.dirname(path), effective, role)
+        continue
+      _, target = self.module(task, self.role_includes)
+      if isinstance(target, dict):
+        self.role(target.get("name"), self.base_dir, target.get("tasks_from", "main"), effective)
+        continue
+      name = self.task_name(task, role)
+      self.task_tags[name] = self.task_tags.get(name, frozenset()) | effective
+
+
+# Définition de l'index inverse d'une variable des serveurs
+class VarIndex:
+  """Associe chaque valeur d'une variable à l'ensemble des serveurs qui la portent. Les valeurs sont également triées,
+  numériquement et textuellement, pour répondre aux comparaisons par recherche dichotomique."""
+
+  def __init__(self, values):
+    self.values = values
+    self.text = sorted(values)
+    numeric = []
+    for value in values:
+      try:
+        numeric.append((float(value), value))
+      except ValueError:
+        pass
+    numeric.sort()
+    self.numbers = [n for (n, _) in numeric]
+    self.numeric_keys = [v for (_, v) in numeric]
+
+  def hosts(self, keys):
+    """Renvoi l'ensemble des serveurs portant l'une des valeurs 'keys'"""
+    return set().union(*[self.values[k] for k in keys])
+
+  def match(self, op, values):
+    """Renvoi l'ensemble des serveurs dont la valeur vérifie le prédicat. '!=' ne retient que les serveurs qui
+    définissent la variable.
+
+    Arguments :
+    op -- opérateur : =, !=, in, >, >=, < ou <=
+    values -- valeurs du prédicat (plusieurs pour 'in')
+    """
+    if op in ("=", "in"):
+      return self.hosts(v for v in values if v in self.values)
+    if op == "!=":
+      return self.hosts(v for v in self.values if v != values[0])
+    try:
+      bound = float(values[0])
+      keys, ordered = self.numeric_keys, self.numbers
+    except ValueError:
+      bound = values[0]
+      keys, ordered = self.text, self.text
+    if op == ">":
+      return self.hosts(keys[bisect.bisect_right(ordered, bound) :])
+    if op == ">=":
+      return self.hosts(keys[bisect.bisect_left(ordered, bound) :])
+    if op == "<":
+      return self.hosts(keys[: bisect.bisect_left(ordered, bound)])
+    return self.hosts(keys[: bisect.bisect_right(ordered, bound)])
+
+
+# Définition de l'ensemble trié utilisé pour la sélection
+class SortedSet(collections.abc.MutableSet):
+  """Ensemble dont l'itération suit l'ordre naturel (voir natural_key). L'ordre est maintenu à chaque ajout, l'affichage
+  de la sélection n'a donc jamais à la retrier."""
+
+  def __init__(self, iterable=()):
+    self.members = set(iterable)
+    self.items = sortedn(self.members)
+    self.keys = [natural_key(x) for x in self.items]
+
+  def __contains__(self, value):
+    return value in self.members
+
+  def __iter__(self):
+    return iter(self.items)
+
+  def __len__(self):
+    return len(self.members)
+
+  def __repr__(self):
+    return "SortedSet({!r})".format(self.items)
+
+  def add(self, value):
+    if value not in self.members:
+      key = natural_key(value)
+      i = bisect.bisect(self.keys, key)
+      self.keys.insert(i, key)
+      self.items.insert(i, value)
+      self.members.add(value)
+
+  def discard(self, value):
+    if value in self.members:
+      i = bisect.bisect_left(self.keys, natural_key(value))
+      del self.keys[i]
+      del self.items[i]
+      self.members.discard(value)
+
+
+# Définition de la classe représentant un serveur
+class Host:
+  """Groupes et variables d'un serveur d'un fichier d'inventaire.
+  Seules les variables listées dans 'resident_vars' sont conservées, les autres sont relues à la demande par
+  Inventories.host_vars(). 'digest' est l'empreinte de l'ensemble des variables du serveur.
+  """
+
+  __slots__ = ("groups", "vars", "digest")
+
+  def __init__(self, groups, vars, digest):
+    self.groups = groups
+    self.vars = vars
+    self.digest = digest
+
+
+# Définition de la classe suivant un déploiement lancé en arrière-plan
+class DeployRun:
+  """Lance ansible-playbook en arrière-plan, enregistre sa sortie dans un journal et suit l'avancement de chaque serveur"""
+
+  re_play = re.compile(r"^PLAY \[(.*)\]")
+  re_task = re.compile(r"^(?:TASK|RUNNING HANDLER) \[(.*)\]")
+  re_result = re.compile(r"^(ok|changed|skipping|failed|fatal): \[([^\]]+?)(?: -> [^\]]+)?\](: UNREACHABLE!)?")
+  re_recap = re.compile(r"^(\S+)\s+:\s+((?:\w+=\d+\s*)+)$")
+  # Ordre de priorité des résultats lorsqu'une tâche renvoi plusieurs résultats pour un serveur (boucles)
+  statuses = ("skipped", "ok", "changed", "failed", "unreachable")
+  # Délai en secondes entre SIGTERM et SIGKILL lors de l'arrêt forcé
+  kill_delay = 5
+
+  def __init__(self, argv, log_path, name="", after=(), inventory=""):
+    self.argv = argv
+    self.log_path = log_path
+    self.name = name
+    self.after = list(after)
+    self.inventory = inventory
+    self.play = ""
+    self.task = ""
+    self.task_results = {}
+    self.task_started = None
+    self.task_times = {}
+    self.timings = []
+    self.hosts = {}
+    self.recap = {}
+    self.in_recap = False
+    self.process = None
+    self.thread = None
+    self.returncode = None
+    self.interrupted = False
+    self.started = None
+    self.finished = None
+    self.callbacks = []
+
+  def start(self):
+    """Lance ansible-playbook et la lecture de sa sortie"""
+    os.makedirs(os.path.dirname(self.log_path), exist_ok=True)
+    env = dict(os.environ, PYTHONUNBUFFERED="1", ANSIBLE_FORCE_COLOR="0", ANSIBLE_NOCOLOR="1")
+    self.started = time.time()
+    # Le processus est placé dans sa propre session afin de ne pas recevoir les Ctrl+C destinés au shell
+    try:
+      self.process = subprocess.Popen(
+        self.argv,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        stdin=subprocess.DEVNULL,
+        encoding="utf-8",
+        errors="replace",
+        env=env,
+        start_new_session=True,
+      )
+    except OSError as e:
+      logging.error("Impossible de lancer {} : {}".format(self.argv[0], e))
+      self.returncode = 127
+      self.finished = time.time()
+      for callback in self.callbacks:
+        callback(self)
+      return
+    self.thread = threading.Thread(target=self.follow, daemon=True)
+    self.thread.start()
+
+  def follow(self):
+    """Lit la sortie d'ansible-playbook au fil de l'eau jusqu'à la fin du processus. La fin du déploiement est
+    enregistrée et signalée même si la lecture échoue."""
+    try:
+      with profiler.timed(command_label(self.argv), "subprocess", file=self.inventory or self.name):
+        self.read_output()
+    finally:
+      self.finished = time.time()
+      for callback in self.callbacks:
+        callback(self)
+
+  def read_output(self):
+    """Enregistre et analyse la sortie d'ansible-playbook puis attend la fin du processus"""
+    try:
+      with open(self.log_path, "w", encoding="utf-8") as log:
+        log.write(" ".join(self.argv) + "\n\n")
+        for line in self.process.stdout:
+          log.write(line)
+          log.flush()
+          self.parse_line(line.rstrip("\n"))
+    except Exception as e:
+      logging.error("Lecture de la sortie de {} interrompue : {}".format(self.name or self.argv[0], e))
+    finally:
+      # La sortie est vidée pour que le processus ne reste pas bloqué sur un tube plein
+      try:
+        self.process.stdout.read()
+      except Exception:
+        pass
+      self.returncode = self.process.wait()
+      self.end_task()
+
+  def parse_line(self, line):
+    """Met à jour l'avancement à partir d'une ligne de la sortie d'ansible-playbook
+
+    Arguments :
+    line -- ligne de la sortie d'ansible-playbook
+    """
+    if line.startswith("PLAY RECAP"):
+      self.end_task()
+      self.in_recap = True
+      return
+    if self.in_recap:
+      match = self.re_recap.match(line)
+      if match:
+        self.recap[match.group(1)] = {k: int(v) for (k, v) in re.findall(r"(\w+)=(\d+)", match.group(2))}
+        return
+    match = self.re_play.match(line)
+    if match:
+      self.end_task()
+      self.in_recap = False
+      self.play = match.group(1)
+      self.task = ""
+      return
+    match = self.re_task.match(line)
+    if match:
+      self.end_task()
+      self.task = match.group(1)
+      self.task_started = time.time()
+      return
+    match = self.re_result.match(line)
+    if match:
+      status, host, unreachable = match.groups()
+      status = {"skipping": "skipped", "fatal": "failed"}.get(status, status)
+      if unreachable:
+        status = "unreachable"
+      previous = self.task_results.get(host)
+      if previous is None or self.statuses.index(status) > self.statuses.index(previous):
+        self.task_results[host] = status
+      if self.task_started is not None:
+        # Un serveur a terminé la tâche à l'arrivée de son dernier résultat
+        self.task_times[host] = time.time() - self.task_started
+      self.hosts.setdefault(host, dict.fromkeys(self.statuses, 0))
+
+  def end_task(self):
+    """Comptabilise le résultat de la tâche en cours pour chaque serveur et conserve sa durée et celle de chaque serveur"""
+    for host, status in self.task_results.items():
+      self.hosts.setdefault(host, dict.fromkeys(self.statuses, 0))[status] += 1
+    if self.task_started is not None:
+      self.timings.append(
+        (
+          self.play,
+          self.task,
+          self.task_started,
+          time.time() - self.task_started,
+          {h: (status, self.task_times.get(h, 0.0)) for (h, status) in self.task_results.items()},
+        )
+      )
+    self.task_results = {}
+    self.task_started = None
+    self.task_times = {}
+
+  def running(self):
+    """Indique si ansible-playbook est en cours d'exécution"""
+    return self.process is not None and self.returncode is None
+
+  def done(self):
+    """Indique si le déploiement est terminé ou a été annulé avant son lancement"""
+    return self.finished is not None or (self.process is None and self.interrupted)
+
+  def succeeded(self):
+    """Indique si le déploiement s'est terminé sans erreur ni interruption"""
+    return self.finished is not None and not self.returncode and not self.interrupted
+
+  def stop(self, timeout=10, wait=True):
+    """Interrompt ansible-playbook comme le ferait un Ctrl+C puis arrête tout son groupe de processus (SIGTERM puis
+    SIGKILL après 'kill_delay' secondes) si sa sortie n'est pas fermée après 'timeout' secondes. Un déploiement qui n'a
+    pas encore été lancé est annulé.
+
+    Arguments :
+    timeout -- délai en secondes avant l'arrêt forcé
+    wait -- attend la fin du processus, sinon le signal est seulement envoyé
+    """
+    if self.process is None:
+      self.interrupted = True
+      return
+    if not self.running():
+      return
+    self.interrupted = True
+    # La fin de la lecture de la sortie est attendue plutôt que celle d'ansible-playbook : un processus fils qui garde la
+    # sortie ouverte est arrêté lui aussi
+    for sig, delay in ((signal.SIGINT, timeout), (signal.SIGTERM, self.kill_delay), (signal.SIGKILL, self.kill_delay)):
+      try:
+        os.killpg(self.process.pid, sig)
+      except ProcessLookupError:
+        pass
+      if not wait:
+        return
+      self.thread.join(delay)
+      if not self.thread.is_alive():
+        return
+    logging.warning("La sortie de {} est toujours ouverte après son arrêt".format(self.name or self.argv[0]))
+
+  def counters(self):
+    """Renvoi les compteurs de chaque serveur. Le récapitulatif d'ansible-playbook est utilisé dès qu'il est disponible."""
+    hosts = {h: dict(c) for (h, c) in list(self.hosts.items())}
+    for host, status in list(self.task_results.items()):
+      hosts.setdefault(host, dict.fromkeys(self.statuses, 0))[status] += 1
+    for host, recap in list(self.recap.items()):
+      hosts[host] = {k: recap.get(k, 0) for k in self.statuses}
+    return hosts
+
+  def state(self):
+    """Renvoi l'état du déploiement sous forme de texte"""
+    if self.process is None and self.returncode is None:
+      return "annulé" if self.interrupted else "en attente"
+    if self.running():
+      return "en cours depuis {:.0f}s".format(time.time() - self.started)
+    if self.interrupted:
+      return "interrompu (code {})".format(self.returncode)
+    return "terminé en {:.0f}s (code {})".format(self.finished - self.started, self.returncode)
+
+
+# Définition de la classe regroupant des déploiements lancés en parallèle
+class Deployment:
+  """Lance un ou plusieurs déploiements en parallèle dans la limite de 'jobs' processus simultanés et agrège leurs
+  résultats. Un déploiement n'est lancé qu'après la réussite de ceux de sa liste 'after' et est annulé si l'un d'eux
+  échoue."""
+
+  def __init__(self, runs, jobs, fail_fast=False):
+    self.runs = runs
+    self.fail_fast = fail_fast
+    self.slots = threading.Semaphore(max(1, jobs))
+    self.changed = threading.Condition()
+    self.cancelled = False
+    self.thread = None
+    self.started = None
+    self.finished = None
+    self.callbacks = []
+
+  def start(self):
+    """Lance les déploiements en arrière-plan"""
+    self.started = time.time()
+    self.thread = threading.Thread(target=self.schedule, daemon=True)
+    self.thread.start()
+
+  def schedule(self):
+    """Lance chaque déploiement dès qu'un emplacement se libère et que les déploiements dont il dépend ont réussi, puis
+    attend la fin de tous les déploiements"""
+    pending = list(self.runs)
+    while pending:
+      with self.changed:
+        ready = None
+        while ready is None:
+          ready = next((r for r in pending if all(a.done() for a in r.after)), None)
+          if ready is None:
+            self.changed.wait()
+      pending.remove(ready)
+      failed = [a for a in ready.after if not a.succeeded()]
+      if self.cancelled or failed:
+        if failed and not self.cancelled:
+          logging.warning(
+            "{} annulé : {} n'a pas réussi.".format(ready.name or "Le déploiement", ", ".join(a.name for a in failed))
+          )
+        ready.stop()
+        self.notify()
+        continue
+      self.slots.acquire()
+      if self.cancelled:
+        self.slots.release()
+        ready.stop()
+        self.notify()
+        continue
+      ready.callbacks.append(self.run_finished)
+      ready.start()
+    for run in self.runs:
+      if run.thread:
+        run.thread.join()
+    self.finished = time.time()
+    for callback in self.callbacks:
+      callback(self)
+
+  def run_finished(self, run):
+    """Libère l'emplacement d'un déploiement terminé et interrompt les autres en cas d'échec si 'fail_fast' est activé
+
+    Arguments :
+    run -- le déploiement terminé
+    """
+    if run.returncode and self.fail_fast and not self.cancelled:
+      logging.warning("{} a échoué, interruption des autres déploiements.".format(run.name or "Le déploiement"))
+      self.stop(wait=False)
+    self.slots.release()
+    self.notify()
+
+  def notify(self):
+    """Réveille l'ordonnanceur en attente de la fin d'un déploiement"""
+    with self.changed:
+      self.changed.notify_all()
+
+  def running(self):
+    """Indique si au moins un déploiement est en attente ou en cours"""
+    return self.thread is not None and self.finished is None
+
+  def stop(self, wait=True):
+    """Annule les déploiements en attente et interrompt ceux en cours
+
+    Arguments :
+    wait -- attend la fin des déploiements interrompus
+    """
+    self.cancelled = True
+    for run in self.runs:
+      run.stop(wait=wait)
+    self.notify()
+
+  def returncode(self):
+    """Renvoi le premier code de sortie non nul des déploiements terminés, 0 s'ils ont tous réussi"""
+    return next((r.returncode for r in self.runs if r.returncode), 0)
+
+  def counters(self):
+    """Renvoi les compteurs de chaque serveur, tous déploiements confondus. Les serveurs d'un déploiement associé à un
+    fichier d'inventaire sont préfixés du nom de ce fichier."""
+    hosts = {}
+    for run in self.runs:
+      if run.inventory:
+        hosts.update(("{}:{}".format(run.inventory, h), c) for (h, c) in run.counters().items())
+      else:
+        hosts.update(run.counters())
+    return hosts
+
+  def state(self):
+    """Renvoi l'état de l'ensemble des déploiements sous forme de texte"""
+    if self.running():
+      return "en cours depuis {:.0f}s".format(time.time() - self.started)
+    if self.cancelled:
+      return "interrompu (code {})".format(self.returncode())
+    return "terminé en {:.0f}s (code {})".format(self.finished - self.started, self.returncode())
+
+  def summary(self):
+    """Renvoi le résumé des déploiements et les compteurs de chaque serveur sous forme de texte"""
+    hosts = self.counters()
+    statuses = DeployRun.statuses
+    lines = ["Déploiement {}".format(self.state())]
+    for run in self.runs:
+      prefix = run.name + " : " if run.name else ""
+      lines.append("{}{}, journal : {}".format(prefix, run.state(), run.log_path))
+      if run.running():
+        lines.append("  Play : {}".format(run.play or "-"))
+        lines.append("  Tâche : {}".format(run.task or "-"))
+    if hosts:
+      width = max(len(h) for h in hosts)
+      lines.append("{}  {}".format("".ljust(width), "  ".join(s.rjust(11) for s in statuses)))
+      for host in sorted(hosts):
+        lines.append("{}  {}".format(host.ljust(width), "  ".join(str(hosts[host][s]).rjust(11) for s in statuses)))
+      totals = [sum(c[s] for c in hosts.values()) for s in statuses]
+      lines.append("{}  {}".format("Total".ljust(width), "  ".join(str(t).rjust(11) for t in totals)))
+    return "\n".join(lines)
+
+
+# Définition de la classe chargeant et tenant à jour les fichiers d'inventaire
+class Inventories:
+  """Contient les serveurs, groupes et tags de chaque fichier d'inventaire et les recharge lorsqu'ils sont modifiés"""
+
+  def __init__(self):
+    self.available = {
+      "files": {},
+      "servers": {},
+      "groups": {},
+      "members": {},
+      "tags": {},
+      "completion": {},
+      "ordered": {},
+      "index": {},
+    }
+    self.fingerprints = {}
+    self.status = {}
+    self.pending = {}
+    self.scheduled = threading.Event()
+    self.executor = None
+    self.listeners = []
+    self.lock = threading.Lock()
+    self.reload_lock = threading.Lock()
+    self.ansible_api = None
+    self.ansible_lock = threading.Lock()
+    self.watcher = None
+    self.watcher_stop = threading.Event()
+
+  def parse_inventory_file(self, inventory_path):
+    """Renvoi dans un dictionnaire l'ensemble des serveurs présent dans le fichier 'inventory_path' avec les variables et
+    groupes dont chaque serveur fait parti ainsi que l'ensembles des groupes disponibles avec les groupes dont ils dépendent
+    et l'index inverse des serveurs de chaque groupe.
+    Le fichier est chargé directement par l'API python d'ansible si 'inventory_backend' vaut 'python', avec repli sur
+    ansible-inventory en cas d'échec.
+
+    Arguments :
+    inventory_path -- fichier d'inventaire ansible à analyser
+    """
+    if inventory_backend == "python" and self.ansible_api is not False:
+      try:
+        with profiler.timed("ansible api", "parse", file=inventory_path):
+          return self.parse_inventory_in_process(inventory_path)
+      except Exception as e:
+        logging.warning(
+          "Chargement de {} par l'API d'ansible impossible, repli sur ansible-inventory : {}".format(inventory_path, e)
+        )
+    with profiler.timed("ansible-inventory --list", "parse", file=inventory_path):
+      return self.parse_inventory_subprocess(inventory_path)
+
+  def parse_inventory_in_process(self, inventory_path):
+    """Équivalent de parse_inventory_subprocess() utilisant l'API python d'ansible dans le processus courant.
+    Le chargeur de fichiers d'ansible est partagé entre tous les fichiers d'inventaire. L'API n'étant pas prévue pour être
+    utilisée par plusieurs threads, les fichiers sont chargés l'un après l'autre.
+
+    Arguments :
+    inventory_path -- fichier d'inventaire ansible à analyser
+    """
+    with self.ansible_lock:
+      if self.ansible_api is None:
+        try:
+          from ansible import constants
+          from ansible.cli import CLI
+          from ansible.inventory.manager import InventoryManager
+          from ansible.parsing.dataloader import DataLoader
+          from ansible.vars.manager import VariableManager
+        except ImportError:
+          self.ansible_api = False
+          raise
+        # Variables retirées par ansible-inventory lui-même (groups, group_names, ansible_version...)
+        INTERNAL_VARS = getattr(constants, "INTERNAL_STATIC_VARS", None)
+        if INTERNAL_VARS is None:
+          try:
+            from ansible.cli.inventory import INTERNAL_VARS
+          except ImportError:
+            INTERNAL_VARS = frozenset()
+        try:
+          loader = DataLoader()
+          # Comme ansible-inventory : aucun mot de passe n'est demandé, le fichier DEFAULT_VAULT_PASSWORD_FILE est ajouté
+          # par setup_vault_secrets()
+          loader.set_vault_secrets(
+            CLI.setup_vault_secrets(loader, vault_ids=list(constants.DEFAULT_VAULT_IDENTITY_LIST), auto_prompt=False)
+          )
+        except Exception:
+          self.ansible_api = False
+          raise
+        self.ansible_api = (loader, InventoryManager, VariableManager, INTERNAL_VARS)
+      loader, InventoryManager, VariableManager, INTERNAL_VARS = self.ansible_api
+
+      inventory = InventoryManager(loader=loader, sources=[inventory_path])
+      variable_manager = VariableManager(loader=loader, inventory=inventory)
+      hosts = {}
+      groups = {}
+      hostvars = {}
+      for name, group in inventory.groups.items():
+        for host in group.hosts:
+          if host.name in hosts:
+            hosts[host.name].append(name)
+          else:
+            hosts[host.name] = [name]
+        if group.child_groups and name not in groups:
+          groups[name] = []
+        for child in group.child_groups:
+          if child.name in groups:
+            groups[child.name].append(name)
+          else:
+            groups[child.name] = [name]
+      for host in inventory.get_hosts():
+        # Mêmes variables que celles renvoyées par ansible-inventory --list
+        variables = variable_manager.get_vars(host=host, include_hostvars=False, stage="all")
+        hostvars[host.name] = reduce_vars({k: v for (k, v) in variables.items() if k not in INTERNAL_VARS})
+    return build_inventory(hosts, groups, hostvars)
+
+  def parse_inventory_subprocess(self, inventory_path):
+    """Renvoi le résultat de parse_inventory_file() en lisant la sortie de la commande ansible-inventory
+
+    Arguments :
+    inventory_path -- fichier d'inventaire ansible à analyser
+    """
+    hosts = {}
+    groups = {}
+    hostvars = {}
+    # La sortie d'ansible-inventory est lue au fil de l'eau : les variables de chaque serveur sont réduites dès leur
+    # lecture, sans jamais construire le document complet en mémoire
+    with tempfile.TemporaryFile() as stderr:
+      process = subprocess.Popen(
+        ("ansible-inventory", "-i", inventory_path, "--list"), stdout=subprocess.PIPE, stderr=stderr
+      )
+      try:
+        stream = JsonStream(process.stdout)
+        for name in stream.items():
+          if name != "_meta":
+            group = stream.value()
+            for host in group.get("hosts", ()):
+              if host in hosts:
+                hosts[host].append(name)
+              else:
+                hosts[host] = [name]
+            if "children" in group:
+              if name not in groups:
+                groups[name] = []
+              for child in group["children"]:
+                if child in groups:
+                  groups[child].append(name)
+                else:
+                  groups[child] = [name]
+            continue
+          for key in stream.items():
+            if key != "hostvars":
+              stream.value()
+              continue
+            for host in stream.items():
+              hostvars[host] = reduce_vars(stream.value())
+      except ValueError as e:
+        error = e
+      else:
+        error = None
+      finally:
+        process.stdout.close()
+        if process.wait() and error is None:
+          error = "code {}".format(process.returncode)
+      if error:
+        stderr.seek(0)
+        lines = stderr.read().decode(errors="replace").strip().splitlines()
+        raise RuntimeError("ansible-inventory a échoué ({}){}".format(error, " : " + lines[-1] if lines else ""))
+    return build_inventory(hosts, groups, hostvars)
+
+  def static_tags(self, playbook):
+    """Renvoi les tags du playbook extraits par TagIndexer ou None s'ils doivent être demandés à ansible-playbook
+
+    Arguments :
+    playbook -- chemin du playbook
+    """
+    if not static_tags_enabled or yaml is None:
+      return None
+    try:
+      return TagIndexer(playbook).run()
+    except (OSError, yaml.YAMLError, AttributeError, TypeError) as e:
+      logging.debug("Extraction des tags de {} impossible : {}".format(playbook, e))
+      return None
+
+  def task_tags(self, playbook):
+    """Renvoi pour chaque tâche du playbook les tags qui la concernent, hérités compris ({} si indisponible)
+
+    Arguments :
+    playbook -- chemin du playbook
+    """
+    if yaml is None:
+      return {}
+    indexer = TagIndexer(playbook)
+    try:
+      indexer.run()
+    except (OSError, yaml.YAMLError, AttributeError, TypeError) as e:
+      logging.debug("Lecture des tâches de {} impossible : {}".format(playbook, e))
+    return indexer.task_tags
+
+  def host_vars(self, f, host):
+    """Renvoi toutes les variables d'un serveur en les relisant avec ansible-inventory
+
+    Arguments :
+    f -- nom du fichier dans le dossier inventory
+    host -- nom du serveur
+    """
+    return json.loads(run_ansible("ansible-inventory", "-i", os.sep.join(("inventory", f)), "--host", host))
+
+  def load_inventory_file(self, f, key, force=False):
+    """Renvoi dans un dictionnaire, dont les clés sont celles de 'available', le chemin, les serveurs, les groupes, les
+    membres des groupes, les tags et les listes triées utilisées par la complétion du fichier d'inventaire 'f'.
+    Renvoi None si le fichier ne contient aucun serveur.
+
+    Arguments :
+    f -- nom du fichier dans le dossier inventory
+    key -- empreinte du fichier renvoyée par inventory_fingerprint()
+    force -- ignore le contenu du cache
+    """
+    f_fullpath = os.sep.join(("inventory", f))
+    cacheable = dynamic_ttl > 0 or not is_dynamic_inventory(f_fullpath)
+    with profiler.timed("cache_load", "reload", file=f):
+      cached = None if force or not cacheable else cache_load(key)
+    if cached:
+      servers, groups, members, tags = cached
+    else:
+      with profiler.timed("parse", "reload", file=f):
+        servers, groups, members = self.parse_inventory_file(f_fullpath)
+      tags = set()
+      if len(servers) > 0:
+        playbook_main = yml_or_yaml("main")
+        with profiler.timed("tags", "reload", file=f):
+          static = self.static_tags(playbook_main)
+          if static is not None:
+            tags = set(static)
+          else:
+            tags_text = run_ansible("ansible-playbook", "-i", f_fullpath, "--list-tags", playbook_main)
+            for regex_tags in re.finditer("TASK TAGS: \[([\w\-, ]+)\]", tags_text):
+              tags.update(regex_tags.group(1).split(", "))
+      if cacheable:
+        with profiler.timed("cache_save", "reload", file=f):
+          cache_save(key, servers, groups, tags)
+    if len(servers) == 0:
+      return None
+    return {
+      "files": f_fullpath,
+      "servers": servers,
+      "groups": groups,
+      "members": members,
+      "tags": tags,
+      "completion": {"servers": sorted(servers), "groups": sorted(groups), "tags": sorted(tags)},
+      "ordered": {"servers": sortedn(servers), "groups": sortedn(groups), "tags": sortedn(tags)},
+      "index": build_var_index(servers, index_vars),
+    }
 
-  Arguments :
-  filename -- le nom d'un fichier sans l'extension
-  """
-  if os.path.isfile(filename + ".yml"):
-    return filename + ".yml"
-  if os.path.isfile(filename + ".yaml"):
-    return filename + ".yaml"
-  return None
+  def list_files(self):
+    """Renvoi la liste triée des fichiers lisibles du dossier inventory"""
+    inventory_files = []
+    for f in sorted(os.listdir("inventory")):
+      f_fullpath = os.sep.join(("inventory", f))
+      if os.path.isfile(f_fullpath) and os.access(f_fullpath, os.R_OK):
+        inventory_files.append(f)
+    return inventory_files
 
+  def update_file(self, f, result):
+    """Remplace les serveurs, groupes et tags d'un fichier d'inventaire.
+    Les dictionnaires sont remplacés et non modifiés afin de ne pas perturber une commande en cours de lecture.
 
-def sortedn(l):
-  """Trie une liste de chaîne de caractères en tenant compte des nombre
+    Arguments :
+    f -- nom du fichier dans le dossier inventory
+    result -- valeur renvoyée par load_inventory_file() ou None pour retirer le fichier
+    """
+    with self.lock:
+      for k in self.available:
+        available = dict(self.available[k])
+        if result:
+          available[f] = result[k]
+        else:
+          available.pop(f, None)
+        self.available[k] = available
 
-  Exemple :
-    sorted(["a34", "a3", "a52", "a6", "a5"])  => ['a3', 'a34', 'a5', 'a52', 'a6']
-    sortedn(["a34", "a3", "a52", "a6", "a5"]) => ['a3', 'a5', 'a6', 'a34', 'a52']
+  def load_and_update_file(self, f, key, force):
+    """Analyse un fichier d'inventaire et intègre le résultat dès qu'il est disponible
+
+    Arguments :
+    f -- nom du fichier dans le dossier inventory
+    key -- empreinte du fichier renvoyée par inventory_fingerprint()
+    force -- ignore le contenu du cache
+    """
+    self.status[f] = "chargement en cours"
+    try:
+      result = self.load_inventory_file(f, key, force)
+    except Exception as e:
+      self.status[f] = "erreur"
+      logging.error("Le chargement du fichier d'inventaire {} a échoué : {}".format(f, e))
+      raise
+    self.update_file(f, result)
+    self.fingerprints[f] = key
+    self.status[f] = "{} serveurs".format(len(result["servers"])) if result else "aucun serveur"
+
+  def reload(self, force=False):
+    """Analyse les fichiers d'inventaire ajoutés ou modifiés depuis le dernier chargement, oublie ceux qui ont été
+    supprimés et renvoi l'ensemble des fichiers dont le contenu a changé.
+
+    Arguments :
+    force -- analyse tous les fichiers sans tenir compte des empreintes ni du cache
+    """
+    with self.reload_lock:
+      self.scheduled.clear()
+      try:
+        base = playbook_fingerprint()
+        keys = {f: inventory_fingerprint(os.sep.join(("inventory", f)), base) for f in self.list_files()}
+        todo = [f for f in keys if force or self.fingerprints.get(f) != keys[f]]
+        removed = [f for f in self.fingerprints if f not in keys]
+        for f in removed:
+          del self.fingerprints[f]
+          self.status.pop(f, None)
+          self.update_file(f, None)
+        for f in todo:
+          self.status[f] = "en attente"
+        self.executor = ThreadPoolExecutor(max_workers=reload_jobs)
+        self.pending = {f: self.executor.submit(self.load_and_update_file, f, keys[f], force) for f in todo}
+      finally:
+        self.scheduled.set()
+      self.executor.shutdown()
+
+    changed = set(removed)
+    changed.update(f for (f, future) in self.pending.items() if not future.cancelled() and not future.exception())
+    if changed:
+      logging.debug("Fichiers d'inventaire rechargés : {}".format(", ".join(sorted(changed))))
+      for listener in list(self.listeners):
+        listener(changed)
+    return changed
+
+  def reload_in_background(self):
+    """Lance reload() en arrière-plan"""
+    threading.Thread(target=self.reload, daemon=True).start()
+
+  def is_loading(self, f):
+    """Indique si le fichier d'inventaire 'f' est en attente d'analyse ou en cours d'analyse"""
+    if not self.scheduled.is_set():
+      return True
+    future = self.pending.get(f)
+    return future is not None and not future.done()
+
+  def wait(self, f):
+    """Attend la fin de l'analyse du fichier d'inventaire 'f' s'il est en cours de chargement"""
+    self.scheduled.wait()
+    future = self.pending.get(f)
+    if future is not None:
+      try:
+        future.result()
+      except Exception:
+        pass
+
+  def close(self):
+    """Arrête la surveillance des fichiers et abandonne les analyses qui n'ont pas encore commencé"""
+    self.unwatch()
+    if self.executor:
+      self.executor.shutdown(wait=False, cancel_futures=True)
+
+  def watch(self, interval):
+    """Lance la surveillance en arrière-plan des fichiers d'inventaire, du playbook et des rôles.
+    inotify est utilisé s'il est disponible, sinon les empreintes sont recalculées toutes les 'interval' secondes.
+
+    Arguments :
+    interval -- délai en secondes entre deux vérifications en l'absence d'inotify
+    """
+    if self.watcher and self.watcher.is_alive():
+      return
+    self.watcher_stop.clear()
+    self.watcher = threading.Thread(target=self.watch_loop, args=(interval,), daemon=True)
+    self.watcher.start()
+
+  def unwatch(self):
+    """Arrête la surveillance des fichiers"""
+    self.watcher_stop.set()
+    if self.watcher:
+      self.watcher.join()
+      self.watcher = None
+
+  def watch_loop(self, interval):
+    """Boucle de surveillance lancée par watch()"""
+    paths = [root for (root, dirs, files) in chain(project_walk(), os.walk("inventory"))]
+    fd = inotify_open(paths)
+    logging.debug("Surveillance des fichiers {}.".format("avec inotify" if fd is not None else "par scrutation"))
+    try:
+      while not self.watcher_stop.is_set():
+        if fd is None:
+          self.watcher_stop.wait(interval)
+        else:
+          ready, _, _ = select.select([fd], [], [], interval)
+          if not ready:
+            continue
+          # Les éditeurs génèrent souvent plusieurs évènements pour une seule sauvegarde
+          time.sleep(0.2)
+          inotify_drain(fd)
+        if not self.watcher_stop.is_set():
+          self.reload()
+    finally:
+      if fd is not None:
+        os.close(fd)
 
-  Arguments :
-  l -- Liste à trier
-  """
-  l = list(l)
-  for i, x in enumerate(l):
-    z = []
-    for y in re.split("(\d+)", x):
-      if re.match("^(\d+)$", y):
-        y = int(y)
-      z.append(y)
-    l[i] = z
-  l.sort()
-  for i, x in enumerate(l):
-    l[i] = "".join([str(y) for y in x])
-  return l
-
-
-# Test si ansible est installé
-if not shutil.which("ansible-playbook"):
-  logging.critical("'ansible-playbook' est absent. Vous devez d'abord installer ansible.")
-  exit(1)
-elif not shutil.which("ansible-inventory"):
-  logging.critical("'ansible-inventory' est absent. Vous devez d'abord installer ansible.")
-  exit(1)
-
-# Test de tous les prérequis :
-# - le fichier main.yaml existe et est accessible en lecture
-# - le dossier inventory existe et n'est pas vide
-playbook_file = yml_or_yaml("main")
-if not playbook_file:
-  logging.critical("Aucun fichier main.yml ou main.yaml n'a été trouvé.")
-  exit(1)
-elif not os.access(playbook_file, os.R_OK):
-  logging.critical("Le fichier {} ne peut pas être lu.".format(playbook_file))
-  exit(1)
-elif not (
-  os.path.isdir("inventory")
-  and os.access("inventory", os.R_OK)
-  and os.access("inventory", os.X_OK)
-  and len(os.listdir("inventory")) >= 1
-):
-  logging.critical("Le dossier inventory n'existe pas.")
-  exit(1)
-
-# Chargement des rôles et collections avec le fichier setup_env.sh s'il existe
-# Sinon, chargement des rôles et collections à partir du requirements.yaml
-run_setup_env_nok = 1
-run_requirements_nok = 1
-
-if os.path.isfile("setup_env.sh") and os.access("setup_env.sh", os.R_OK):
-  logging.debug("Lancement de setup_env.sh.")
-  run_setup_env_nok = subprocess.run(["sh", "setup_env.sh"]).returncode
-  logging.debug("setup_env.sh a été lancé et la valeur de sortie obtenu est {}".format(run_setup_env_nok))
-else:
-  logging.debug("Le fichier setup_env.sh n'existe pas ou n'est pas lisible.")
-
-if run_setup_env_nok:
-  if not shutil.which("ansible-galaxy"):
-    logging.critical("ansible-galaxy ne semble pas présent")
-    exit(1)
-  requirements_file = yml_or_yaml("requirements")
-  if requirements_file and os.access(requirements_file, os.R_OK):
-    requirements_cmd = ["ansible-galaxy", "install", "-p", "./roles", "-r", requirements_file, "-f"]
-    logging.debug(
-      "Lancement du chargement des roles et collections avec la commande {}".format(" ".join(requirements_cmd))
-      )
-    run_requirements_nok = subprocess.run(requirements_cmd).returncode
-    logging.debug("ansible-galaxy a été lancé et la valeur de sortie obtenu est {}".format(run_requirements_nok))
-    if run_requirements_nok:
-      logging.critical("Le chargement des rôles et collections depuis le fichier requirements a rencontré une erreur.")
-      exit(1)
-  else:
-    logging.warning("Le fichier requirements.yaml (ou .yml) n'existe pas ou n'est pas lisible.")
 
 # Définition de la classe servant au shell interactif
 class Ansiblator(cmd.Cmd):
   """Défini les commandes et options du shell interactif"""
 
-  def __init__(self, *args, **kwargs):
+  def __init__(self, inventories=None, *args, **kwargs):
+    """Arguments :
+    inventories -- inventaires partagés avec d'autres sessions (mode démon), sinon ils sont chargés par ce shell
+    """
     super().__init__(*args, **kwargs)
     self.intro = "\nBienvenue sur ansiblator !\n"
     self.prompt = "# "
     list_do_docstring = self.parse_do_docstring()
     self.aliases = self.create_alias_from_docstring(list_do_docstring)
     self.all_help = self.generate_help_all_cmd(list_do_docstring)
+    # Les noms de serveurs contiennent souvent des caractères considérés par défaut comme des séparateurs
+    readline.set_completer_delims(" \t\n")
     self.do_reset()
-    self.do_reload()
+    self.deploy = None
+    # Contenu des fichiers de --limit préparés par limit_argument(), écrits une fois le déploiement confirmé
+    self.limit_files = {}
+    self.shared = inventories is not None
+    self.inventories = inventories if self.shared else Inventories()
+    self.available = self.inventories.available
+    self.inventories.listeners.append(self.prune_selection)
+    if not self.shared:
+      self.inventories.reload_in_background()
+      if watch_enabled:
+        self.inventories.watch(watch_interval)
 
   def parse_do_docstring(self):
     """Renvoi un tableau à partir des docstring des fonctions"""
@@ -181,69 +2396,6 @@ class Ansiblator(cmd.Cmd):
 
     return output
 
-  def search_all(self, items, list_all_items, data=None):
-    """Renvoi récursivement pour chaque éléments de la liste 'items' présent dans 'list_all_items', les valeurs
-    correspondante à 'items'.
-
-    Arguments :
-    items -- liste des élements à chercher dans 'list_all_items'.
-    list_all_items -- dictionnaire dont la valeur est un set contenant les dépendances de la clé.
-    data -- set contenant permettant le passage de la liste des dépendances durant la récursivité.
-    """
-    if data is None:
-      data = set()
-    if not isinstance(items, list):
-      items = list(items)
-    for item in items:
-      data.add(item)
-      if item in list_all_items:
-        data.update(self.search_all(list_all_items[item], list_all_items, data))
-    return data
-
-  def parse_inventory_file(self, inventory_path):
-    """Renvoi dans un dictionnaire l'ensemble des serveurs présent dans le fichier 'inventory_path' avec les variables et
-    groupes dont chaque serveur fait parti ainsi que l'ensembles des groupes disponibles avec les groupes dont ils dépendent.
-
-    Arguments :
-    inventory_path -- fichier d'inventaire ansible à analyser
-    """
-    json_inventory = json.loads(
-      subprocess.run(
-        ("ansible-inventory", "-i", inventory_path, "--list"),
-        stdout=subprocess.PIPE,
-        stderr=subprocess.DEVNULL,
-        universal_newlines=True,
-      ).stdout
-    )
-    hosts = {}
-    groups = {}
-    hostvars = {}
-    for name in json_inventory:
-      if "hosts" in json_inventory[name]:
-        for host in json_inventory[name]["hosts"]:
-          if host in hosts:
-            hosts[host].append(name)
-          else:
-            hosts[host] = [name]
-      elif "children" in json_inventory[name]:
-        if name not in groups:
-          groups[name] = []
-        for group in json_inventory[name]["children"]:
-          if group in groups:
-            groups[group].append(name)
-          else:
-            groups[group] = [name]
-      elif "hostvars" in json_inventory[name]:
-        hostvars = json_inventory[name]["hostvars"]
-    groups_all = {k: self.search_all(v, groups, set([k])) for (k, v) in groups.items()}
-    servers = {}
-    for host in hosts:
-      hostgroups = set()
-      for hostgroup in hosts[host]:
-        hostgroups.update(groups_all.get(hostgroup, set()))
-      servers[host] = {"vars": hostvars.get(host, set()), "groups": hostgroups}
-    return (servers, groups)
-
   # def list_inventory(self):
   #   """Liste les différents fichiers d'inventaire et leurs contenu."""
   #   files, servers, groups = [], {}, {}
@@ -264,6 +2416,399 @@ class Ansiblator(cmd.Cmd):
   #         files.append(f)
   #   return files, servers[f], groups[f]
 
+  def prune_selection(self, changed):
+    """Retire de la sélection les serveurs, groupes et tags qui n'existent plus après un rechargement
+
+    Arguments :
+    changed -- ensemble des fichiers d'inventaire modifiés
+    """
+    f = self.selected["file"]
+    if not f or f not in changed:
+      return
+    if f not in self.available["files"]:
+      print("\nLe fichier d'inventaire {} n'est plus disponible, la sélection est réinitialisée.".format(f), file=self.stdout)
+      self.do_reset()
+      return
+    for key, label, available in (
+      ("servers", "Serveurs", self.available["servers"][f]),
+      ("groups", "Groupes", self.available["groups"][f]),
+      ("tags", "Tags", self.available["tags"][f]),
+      ("skiptags", "Skiptags", self.available["tags"][f]),
+    ):
+      missing = self.selected[key] - set(available)
+      if missing:
+        self.selected[key] -= missing
+        print(
+          "\n{} disparus de {} et retirés de la sélection : {}".format(label, f, ", ".join(sortedn(missing))),
+          file=self.stdout,
+        )
+
+  def match_servers(self, patterns, servers, members):
+    """Renvoi l'ensemble des serveurs de 'servers' désignés par des expressions régulières ou des motifs ansible
+
+    Arguments :
+    patterns -- liste d'expressions régulières ou de motifs ansible (voir select_hosts())
+    servers -- dictionnaire des serveurs parmi lesquels chercher
+    members -- index des serveurs de chaque groupe
+    """
+    matched = match_names([p for p in patterns if not is_host_pattern(p)], servers)
+    for p in patterns:
+      if is_host_pattern(p):
+        matched.update(h for h in select_hosts(p, servers, members) if h in servers)
+    return matched
+
+  def completenames(self, text, *ignored):
+    """Complète le nom des commandes et de leurs alias"""
+    return super().completenames(text, *ignored) + sorted(a for a in self.aliases if a.startswith(text))
+
+  def completedefault(self, text, line, begidx, endidx):
+    """Complète les arguments d'une commande appelée par l'un de ses alias"""
+    cmd = self.parseline(line)[0]
+    if cmd in self.aliases:
+      compfunc = getattr(self, "complete_" + self.aliases[cmd].__name__[3:], None)
+      if compfunc:
+        return compfunc(text, line, begidx, endidx)
+    return []
+
+  def complete_available(self, kind, text):
+    """Renvoi les serveurs, groupes ou tags du fichier d'inventaire sélectionné commençant par 'text'
+
+    Arguments :
+    kind -- 'servers', 'groups' ou 'tags'
+    text -- début du nom à compléter
+    """
+    completion = self.available["completion"].get(self.selected["file"])
+    return complete_prefix(completion[kind], text) if completion else []
+
+  def complete_add(self, text, line, begidx, endidx):
+    return self.complete_available("servers", text)
+
+  def complete_gadd(self, text, line, begidx, endidx):
+    return self.complete_available("groups", text)
+
+  def complete_gremove(self, text, line, begidx, endidx):
+    return complete_prefix(sorted(self.selected["groups"]), text)
+
+  def complete_inventory(self, text, line, begidx, endidx):
+    return [f for f in self.inventories.list_files() if f.startswith(text)]
+
+  def complete_remove(self, text, line, begidx, endidx):
+    return complete_prefix(sorted(self.selected["servers"]), text)
+
+  def complete_skiptag(self, text, line, begidx, endidx):
+    return self.complete_available("tags", text)
+
+  def complete_tags(self, text, line, begidx, endidx):
+    return self.complete_available("tags", text)
+
+  def selected_hosts(self, f=None):
+    """Renvoi l'ensemble des serveurs sélectionnés, directement ou par l'un de leurs groupes
+
+    Arguments :
+    f -- fichier d'inventaire dans lequel chercher la sélection, par défaut le fichier sélectionné
+    """
+    f = f or self.selected["file"]
+    servers = self.available["servers"].get(f, {})
+    members = self.available["members"].get(f, {})
+    return {s for s in self.selected["servers"] if s in servers}.union(
+      *[members.get(g, ()) for g in self.selected["groups"]]
+    )
+
+  def limit_argument(self, hosts, f=None):
+    """Renvoi la valeur de --limit désignant les serveurs 'hosts'. Un motif trop long est passé sous la forme @fichier :
+    le fichier, de nom unique, n'est écrit que par write_limit_files() lorsque le déploiement est confirmé.
+
+    Arguments :
+    hosts -- ensemble des serveurs à désigner
+    f -- fichier d'inventaire des serveurs, par défaut le fichier sélectionné
+    """
+    f = f or self.selected["file"]
+    terms = limit_cover(hosts, self.available["members"][f], self.available["servers"][f].keys())
+    limit = ",".join(terms)
+    if len(limit) <= limit_max:
+      return limit
+    limit_file = os.path.join(
+      limits_dir, "{}-{}.limit".format(hashlib.sha256(limit.encode()).hexdigest()[:16], os.urandom(4).hex())
+    )
+    self.limit_files[limit_file] = "\n".join(terms) + "\n"
+    return "@" + limit_file
+
+  def write_limit_files(self, commands):
+    """Écrit les fichiers de --limit utilisés par les commandes 'commands' et renvoi leurs chemins. Renvoi None après
+    avoir affiché l'erreur si l'un d'eux ne peut pas être écrit.
+
+    Arguments :
+    commands -- listes d'arguments de ansible-playbook renvoyées par deploy_command()
+    """
+    paths = [
+      arg[1:]
+      for argv in commands
+      for (option, arg) in zip(argv, argv[1:])
+      if option == "--limit" and arg[1:] in self.limit_files
+    ]
+    try:
+      os.makedirs(limits_dir, exist_ok=True)
+      for path in paths:
+        with open(path, "w") as fd:
+          fd.write(self.limit_files[path])
+    except OSError as e:
+      print("Impossible d'écrire les fichiers de --limit dans {} : {}".format(limits_dir, e))
+      remove_files(paths)
+      return None
+    return paths
+
+  def deploy_command(self, hosts=None, f=None):
+    """Renvoi la liste des arguments de la commande ansible-playbook correspondant à la sélection
+
+    Arguments :
+    hosts -- ensemble des serveurs à désigner avec --limit à la place des serveurs et groupes sélectionnés
+    f -- fichier d'inventaire à déployer, par défaut le fichier sélectionné
+    """
+    f = f or self.selected["file"]
+    argv = ["ansible-playbook", "--inventory", self.available["files"][f]]
+    if hosts is None and (self.selected["servers"] or self.selected["groups"]):
+      hosts = self.selected_hosts(f)
+      if not hosts:
+        # Aucun serveur effectif : les noms sont passés tels quels pour ne pas déployer sur tout l'inventaire
+        argv += ["--limit", ",".join(sorted(self.selected["servers"] | self.selected["groups"]))]
+    if hosts:
+      argv += ["--limit", self.limit_argument(hosts, f)]
+    if self.selected["tags"]:
+      argv += ["--tags", ",".join(self.selected["tags"])]
+    if self.selected["skiptags"]:
+      argv += ["--skip-tags", ",".join(self.selected["skiptags"])]
+    argv.append(yml_or_yaml("main"))
+    return argv
+
+  def deploy_files(self, names, stages):
+    """Renvoi la liste des fichiers d'inventaire à déployer, ceux de l'ordre imposé en premier, après la fin de leur
+    chargement. Renvoi une liste vide après avoir affiché l'erreur si un fichier est inconnu ou sans serveur.
+
+    Arguments :
+    names -- valeur de l'option --inventories : noms séparés par des virgules ou 'all', None pour ceux de l'ordre
+    stages -- étapes de l'option --order, ensembles de noms de fichiers
+    """
+    ordered = [f for stage in stages for f in sortedn(stage)]
+    if names == "all":
+      files = self.inventories.list_files()
+    elif names:
+      files = [f for f in names.split(",") if f]
+    else:
+      files = ordered
+    for f in files:
+      if self.inventories.is_loading(f):
+        print("Chargement du fichier d'inventaire {} en cours...".format(f))
+        self.inventories.wait(f)
+    missing = [f for f in files if f not in self.available["files"]]
+    if names == "all":
+      files = [f for f in files if f not in missing]
+    elif missing:
+      print("Fichiers d'inventaire inconnus, vides ou en erreur : {}".format(", ".join(missing)))
+      return []
+    unknown = [f for f in ordered if f not in files]
+    if unknown:
+      print("Fichiers de l'ordre absents de --inventories ou sans serveur : {}".format(", ".join(unknown)))
+      return []
+    if not files:
+      print("Aucun fichier d'inventaire ne contient de serveur.")
+    return ordered + [f for f in files if f not in ordered]
+
+  def deploy_plan(self, f, shards, changed_only, pattern=None, label=""):
+    """Renvoi les commandes ansible-playbook déployant le fichier d'inventaire 'f' et les empreintes des serveurs visés.
+    La liste des commandes est vide si aucun serveur n'est à déployer.
+
+    Arguments :
+    f -- nom du fichier d'inventaire
+    shards -- nombre de commandes entre lesquelles répartir les serveurs
+    changed_only -- ne déploie que les serveurs modifiés depuis leur dernier déploiement réussi
+    pattern -- motif ansible désignant les serveurs à la place de la sélection
+    label -- préfixe des messages, vide pour un déploiement du seul fichier sélectionné
+    """
+    hosts = None
+    if pattern:
+      try:
+        hosts = select_hosts(pattern, self.available["servers"][f], self.available["members"][f])
+      except (re.error, ValueError) as e:
+        print("{}Expression invalide : {}".format(label, e))
+        return [], {}
+    elif label:
+      # Les noms sélectionnés absents du fichier sont ignorés plutôt que passés tels quels à --limit
+      hosts = self.selected_hosts(f)
+    if hosts is not None and not hosts:
+      print("{}Aucun serveur ne correspond à la sélection.".format(label))
+      return [], {}
+    fingerprints = self.host_fingerprints(self.target_hosts(f) if hosts is None else hosts, f)
+    if changed_only:
+      hosts = self.changed_hosts(fingerprints, f)
+      if not hosts:
+        print("{}Aucun serveur n'a changé depuis son dernier déploiement réussi.".format(label))
+        return [], fingerprints
+      print(
+        "{}{} serveurs sur {} ont changé depuis leur dernier déploiement réussi.".format(
+          label, len(hosts), len(fingerprints)
+        )
+      )
+    elif label:
+      print("{}{} serveurs.".format(label, len(hosts)))
+    if shards > 1:
+      hosts = sortedn(self.selected_hosts(f) if hosts is None else hosts)
+      if not hosts:
+        print("{}Aucun serveur ne correspond à la sélection.".format(label))
+        return [], fingerprints
+      return [self.deploy_command(set(part), f) for part in split_balanced(hosts, shards)], fingerprints
+    return [self.deploy_command(hosts, f)], fingerprints
+
+  def hosts_matching(self, predicates):
+    """Renvoi l'ensemble des serveurs du fichier d'inventaire sélectionné vérifiant tous les prédicats, à partir des index
+    ou, pour une variable non indexée mais conservée en mémoire, d'un index construit à la volée.
+    Lève une exception ValueError si une variable n'est pas conservée en mémoire ou si le fichier d'inventaire n'a pas
+    d'index (aucun fichier sélectionné, fichier vide ou qui n'a pas pu être chargé).
+
+    Arguments :
+    predicates -- prédicats renvoyés par parse_predicates()
+    """
+    f = self.selected["file"]
+    if not f:
+      raise ValueError("Vous devez d'abord sélectionner un fichier d'inventaire avec la commande 'inventory'.")
+    if self.inventories.is_loading(f):
+      print("Chargement du fichier d'inventaire {} en cours...".format(f))
+      self.inventories.wait(f)
+    index = self.available["index"].get(f)
+    if index is None:
+      raise ValueError("Le fichier d'inventaire {} ne contient aucun serveur ou n'a pas pu être chargé.".format(f))
+    result = None
+    for key, op, values in predicates:
+      if key not in index:
+        check_resident([key])
+        index = dict(index, **build_var_index(self.available["servers"][f], [key]))
+      hosts = index[key].match(op, values)
+      result = hosts if result is None else result & hosts
+      if not result:
+        break
+    return result or set()
+
+  def target_hosts(self, f=None):
+    """Renvoi l'ensemble des serveurs concernés par un déploiement : la sélection ou, à défaut, tout l'inventaire
+
+    Arguments :
+    f -- fichier d'inventaire déployé, par défaut le fichier sélectionné
+    """
+    f = f or self.selected["file"]
+    if self.selected["servers"] or self.selected["groups"]:
+      return self.selected_hosts(f)
+    return set(self.available["servers"][f])
+
+  def host_fingerprints(self, hosts, f=None):
+    """Renvoi l'empreinte de déploiement de chaque serveur de 'hosts' : playbook, rôles, variables du serveur et tags
+    utilisés
+
+    Arguments :
+    hosts -- ensemble des serveurs
+    f -- fichier d'inventaire des serveurs, par défaut le fichier sélectionné
+    """
+    servers = self.available["servers"][f or self.selected["file"]]
+    base = "{}\0{}\0{}".format(
+      deploy_fingerprint(), ",".join(self.selected["tags"]), ",".join(self.selected["skiptags"])
+    ).encode()
+    return {h: hashlib.sha256(base + servers[h].digest).hexdigest() for h in hosts if h in servers}
+
+  def changed_hosts(self, fingerprints, f=None):
+    """Renvoi l'ensemble des serveurs dont l'empreinte diffère de celle de leur dernier déploiement réussi
+
+    Arguments :
+    fingerprints -- empreintes renvoyées par host_fingerprints()
+    f -- fichier d'inventaire des serveurs, par défaut le fichier sélectionné
+    """
+    state = state_load(f or self.selected["file"])
+    return {h for (h, fingerprint) in fingerprints.items() if state.get(h) != fingerprint}
+
+  def record_run(self, f, fingerprints, run):
+    """Enregistre l'empreinte des serveurs déployés sans échec par un déploiement arrivé à son récapitulatif
+
+    Arguments :
+    f -- nom du fichier d'inventaire déployé
+    fingerprints -- empreintes des serveurs calculées au lancement du déploiement
+    run -- le déploiement terminé
+    """
+    if run.interrupted:
+      return
+    succeeded = {
+      h: fingerprints[h]
+      for (h, recap) in run.recap.items()
+      if h in fingerprints and not recap.get("failed") and not recap.get("unreachable")
+    }
+    if succeeded:
+      state_update(f, succeeded)
+
+  def deploy_finished(self, deployment):
+    """Signale la fin d'un déploiement lancé en arrière-plan
+
+    Arguments :
+    deployment -- le déploiement terminé
+    """
+    hosts = deployment.counters()
+    failed = [h for h in hosts if hosts[h]["failed"] or hosts[h]["unreachable"]]
+    print(
+      "\nDéploiement {}, {} serveurs dont {} en échec.".format(deployment.state(), len(hosts), len(failed)),
+      file=self.stdout,
+    )
+    if failed:
+      print("Serveurs en échec : {}".format(", ".join(sorted(failed))), file=self.stdout)
+
+  def complete_line(self, line, begidx, endidx):
+    """Renvoi les complétions de la ligne 'line' entre les positions 'begidx' et 'endidx', comme complete() mais sans
+    readline (utilisé pour les clients du démon)
+    """
+    text = line[begidx:endidx]
+    stripped = len(line) - len(line.lstrip())
+    line = line.lstrip()
+    begidx, endidx = begidx - stripped, endidx - stripped
+    if begidx > 0:
+      command, _, _ = self.parseline(line)
+      compfunc = getattr(self, "complete_" + command, self.completedefault) if command else self.completedefault
+    else:
+      compfunc = self.completenames
+    return compfunc(text, line, begidx, endidx) or []
+
+  def onecmd(self, line):
+    """Lance la commande 'line' en mesurant sa durée"""
+    with profiler.timed(line.strip().split(" ", 1)[0], "command"):
+      return super().onecmd(line)
+
+  def wait_deploy(self):
+    """Attend la fin du déploiement en cours, par exemple avant de quitter le shell. Un Ctrl+C l'interrompt."""
+    if not self.deploy or not self.deploy.running():
+      return
+    print("Attente de la fin du déploiement en cours (Ctrl+C pour l'interrompre)...")
+    try:
+      while self.deploy.running():
+        self.deploy.thread.join(0.5)
+    except KeyboardInterrupt:
+      print("Interruption du déploiement...")
+      self.deploy.stop()
+      self.deploy.thread.join()
+
+  def cmdloop(self, intro=None):
+    """Lance le shell. Un Ctrl+C à l'invite interrompt le déploiement en cours et quitte proprement le shell."""
+    try:
+      super().cmdloop(intro)
+    except KeyboardInterrupt:
+      print()
+      if self.deploy and self.deploy.running():
+        print("Interruption du déploiement...")
+        self.deploy.stop()
+        self.deploy.thread.join()
+      self.postloop()
+
+  def postloop(self):
+    """Action à lancer à la sortie du shell"""
+    self.wait_deploy()
+    if profile_export and profiler.records:
+      profiler.export(profile_export)
+    self.inventories.listeners.remove(self.prune_selection)
+    if not self.shared:
+      self.inventories.close()
+
   def emptyline(self):
     """Action à lancer lors de la validation d'une ligne vide"""
     pass
@@ -274,7 +2819,9 @@ class Ansiblator(cmd.Cmd):
     if cmd in self.aliases:
       self.aliases[cmd](arg)
     elif cmd == "EOF":
-      return True
+      # L'entrée est fermée : il n'est plus possible d'interrompre le déploiement en cours avec 'abort'
+      self.wait_deploy()
+      return self.do_quit("")
     else:
       print('Commande "{}" inconnu.'.format(line))
       print('Utilisez la commande "help" pour obtenir la liste des commandes disponibles.')
@@ -285,8 +2832,16 @@ class Ansiblator(cmd.Cmd):
 
     @wraps(func)
     def wrapper(self, *args, **kwargs):
-      if not self.selected["file"] or self.selected["file"] not in self.available["files"]:
+      if not self.selected["file"]:
         print("Vous devez d'abord sélectionner un fichier d'inventaire avec la commande 'inventory'.")
+        return
+      if self.inventories.is_loading(self.selected["file"]):
+        print("Chargement du fichier d'inventaire {} en cours...".format(self.selected["file"]))
+        self.inventories.wait(self.selected["file"])
+      if self.selected["file"] not in self.available["files"]:
+        print(
+          "Le fichier d'inventaire {} ne contient aucun serveur ou n'a pas pu être chargé.".format(self.selected["file"])
+        )
       else:
         func(self, *args, **kwargs)
 
@@ -308,11 +2863,32 @@ class Ansiblator(cmd.Cmd):
     return wrapper
 
   ## Définition des commandes du shell interactif (par ordre alphabétique)
+  def do_abort(self, arg):
+    """Interrompt le déploiement en cours
+    Usage : abort"""
+    if not self.deploy or not self.deploy.running():
+      print("Aucun déploiement n'est en cours.")
+      return
+    print("Interruption du déploiement...")
+    self.deploy.stop()
+
   @need_inventory
   def do_add(self, arg):
-    """Ajoute un serveur à la selection
-    Usage : add <serveur> [<serveur>...]
+    """Ajoute un serveur à la selection, ou tous les serveurs dont les variables vérifient les prédicats
+    Usage : add <serveur|prédicat> [<serveur>...|and <prédicat>...]
     Alias : a"""
+    predicates = parse_predicates(arg)
+    if predicates:
+      try:
+        matched = self.hosts_matching(predicates)
+      except ValueError as e:
+        print(e)
+        return
+      added = matched - self.selected["servers"]
+      for server in sortedn(added):
+        self.selected["servers"].add(server)
+      print("{} serveurs ajoutés ({} correspondent).".format(len(added), len(matched)))
+      return
     args = sorted(arg.split(" "))
     for a in args:
       if a in self.available["servers"][self.selected["file"]]:
@@ -321,92 +2897,186 @@ class Ansiblator(cmd.Cmd):
       else:
         print("{} n'a pas été trouvé.".format(a))
 
-  @need_server
   def do_deploy(self, arg):
-    """Déploie sur le ou les serveurs selectionnés
-    Usage : deploy
-    Alias : go"""
-    self.do_show()
+    """Déploie en arrière-plan sur le ou les serveurs selectionnés, dans un ou plusieurs fichiers d'inventaire
+    Usage : deploy [--shards <N>] [--jobs <N>] [--fail-fast] [--changed-only] [--inventories <fichier,...|all>] [--order <fichier,...>fichier,...>] [--pattern <motif>]
+    Alias : go
 
-    cmd = "ansible-playbook --inventory " + self.available["files"][self.selected["file"]]
-    if self.selected["servers"] or self.selected["groups"]:
-      cmd += " --limit {}".format(",".join(self.selected["servers"] | self.selected["groups"]))
-    if self.selected["tags"]:
-      cmd += " --tags {}".format(",".join(self.selected["tags"]))
-    if self.selected["skiptags"]:
-      cmd += " --skip-tags {}".format(",".join(self.selected["skiptags"]))
-    playbook_file = yml_or_yaml("main")
-    cmd += " " + playbook_file
-    print("Commande : " + cmd)
+    Le fichier d'inventaire sélectionné est déployé, ou plusieurs fichiers à la fois avec --inventories ('all' pour tous
+    les fichiers chargés). Les fichiers sont déployés en parallèle sauf ordre imposé par --order : les étapes séparées
+    par '>' ne sont lancées qu'après la réussite de la précédente. --pattern remplace la sélection par un motif ansible
+    évalué dans chaque fichier."""
+    try:
+      options, _ = parse_options(
+        arg,
+        {
+          "--shards": True,
+          "--jobs": True,
+          "--fail-fast": False,
+          "--changed-only": False,
+          "--inventories": True,
+          "--order": True,
+          "--pattern": True,
+        },
+      )
+      shards = int(options.get("--shards", 1))
+      jobs = int(options.get("--jobs", deploy_jobs))
+      stages = [set(filter(None, stage.split(","))) for stage in options.get("--order", "").split(">") if stage]
+    except ValueError as e:
+      print(e)
+      return
+    multi = "--inventories" in options or "--order" in options
+    if "--pattern" in options and not multi:
+      print("L'option --pattern n'est utilisable qu'avec --inventories ou --order.")
+      return
+    if "--pattern" not in options and not self.selected["servers"] and not self.selected["groups"]:
+      print("Aucun serveurs ou groupes de serveurs n'est sélectionné.")
+      print(
+        "Utilisez la commande 'help' voir la liste des commandes permettant l'ajout de serveurs ou de groupes de serveurs."
+      )
+      return
+    if self.deploy and self.deploy.running():
+      print("Un déploiement est déjà en cours. Utilisez 'status' pour suivre son avancement ou 'abort' pour l'interrompre.")
+      return
+
+    self.limit_files = {}
+    if multi:
+      files = self.deploy_files(options.get("--inventories"), stages)
+      if not files:
+        return
+      plan = {}
+      for f in files:
+        commands, fingerprints = self.deploy_plan(
+          f, shards, "--changed-only" in options, options.get("--pattern"), f + " : "
+        )
+        if commands:
+          plan[f] = (commands, fingerprints)
+      if not plan:
+        print("Aucun serveur à déployer.")
+        return
+    else:
+      self.do_show()
+      f = self.selected["file"]
+      if f not in self.available["files"]:
+        return
+      plan = {f: self.deploy_plan(f, shards, "--changed-only" in options)}
+      if not plan[f][0]:
+        return
+    for f, (commands, _) in plan.items():
+      for argv in commands:
+        print("Commande : " + " ".join(argv))
     print()
     user_answer = input("Êtes-vous sûr ? (oui/NON) : ").strip().lower()
+    limit_files = None
     if (len(user_answer)==3 and user_answer in('yes', 'oui')) or (len(user_answer)==1 and user_answer in('y', 'o')):
-      subprocess.run(cmd.split(" "))
+      limit_files = self.write_limit_files([argv for (commands, _) in plan.values() for argv in commands])
+    self.limit_files = {}
+    if limit_files is not None:
+      log_prefix = os.path.join(logs_dir, "deploy-{}".format(time.strftime("%Y%m%d-%H%M%S")))
+      task_tags = self.inventories.task_tags(yml_or_yaml("main"))
+      runs = {}
+      for f, (commands, fingerprints) in plan.items():
+        prefix = "{}-{}".format(log_prefix, f) if multi else log_prefix
+        if len(commands) == 1:
+          runs[f] = [DeployRun(commands[0], prefix + ".log", f if multi else "", inventory=f if multi else "")]
+        else:
+          runs[f] = [
+            DeployRun(
+              argv,
+              "{}-shard{}.log".format(prefix, i),
+              "{}Partie {}/{}".format(f + " " if multi else "", i, len(commands)),
+              inventory=f if multi else "",
+            )
+            for (i, argv) in enumerate(commands, 1)
+          ]
+        for run in runs[f]:
+          run.callbacks.append(lambda run, f=f, fingerprints=fingerprints: self.record_run(f, fingerprints, run))
+          run.callbacks.append(lambda run, f=f: history_record(f, run, task_tags))
+      # Chaque déploiement d'une étape attend la réussite de tous ceux de l'étape précédente
+      previous = []
+      for stage in stages:
+        current = [run for f in sorted(stage) for run in runs.get(f, ())]
+        if not current:
+          continue
+        for run in current:
+          run.after = previous
+        previous = current
+      self.deploy = Deployment([run for f in runs for run in runs[f]], jobs, fail_fast="--fail-fast" in options)
+      self.deploy.callbacks.append(self.deploy_finished)
+      self.deploy.callbacks.append(lambda deployment: remove_files(limit_files))
+      self.deploy.start()
+      print("Déploiement lancé en arrière-plan (journaux : {}*).".format(log_prefix))
+      print("Utilisez 'status' pour suivre son avancement et 'abort' pour l'interrompre.")
     else:
       print("Déploiement annulé !")
 
   @need_inventory
   def do_eadd(self, arg):
-    """Ajoute un ou plusieurs serveurs à la selection selon une regex
-    Usage : eadd <regex serveur>
+    """Ajoute un ou plusieurs serveurs à la selection selon une regex ou un motif ansible
+    Usage : eadd <regex serveur|motif> [<regex serveur|motif>...]
     Alias : e"""
-    args = sorted(arg.split(" "))
-    no_action = True
-    for a in args:
-      for server in self.available["servers"][self.selected["file"]]:
-        if re.search(a, server):
-          self.selected["servers"].add(server)
-          print("{} ajouté.".format(server))
-          no_action = False
-    if no_action:
+    servers = self.available["servers"][self.selected["file"]]
+    members = self.available["members"][self.selected["file"]]
+    try:
+      matched = self.match_servers(arg.split(), servers, members)
+    except (re.error, ValueError) as e:
+      print("Expression invalide : {}".format(e))
+      return
+    for server in sorted(matched - self.selected["servers"]):
+      self.selected["servers"].add(server)
+      print("{} ajouté.".format(server))
+    if not matched:
       print("Aucun serveur n'a pas été ajouté.")
 
   @need_inventory
   def do_egadd(self, arg):
     """Ajoute les serveurs d'un groupe à la selection selon une regex
-    Usage : egadd <regex groupe>
+    Usage : egadd <regex groupe> [<regex groupe>...]
     Alias : eg"""
-    args = sorted(arg.split(" "))
-    no_action = True
-    for a in args:
-      for group in self.available["groups"][self.selected["file"]]:
-        if re.search(a, group):
-          self.selected["groups"].add(group)
-          print("{} ajouté.".format(group))
-          no_action = False
-    if no_action:
+    members = self.available["members"][self.selected["file"]]
+    try:
+      matched = match_names(arg.split(), self.available["groups"][self.selected["file"]])
+    except (re.error, ValueError) as e:
+      print("Expression invalide : {}".format(e))
+      return
+    for group in sorted(matched - self.selected["groups"]):
+      self.selected["groups"].add(group)
+      print("{} ajouté ({} serveurs).".format(group, len(members.get(group, ()))))
+    if not matched:
       print("Aucun groupe n'a pas été ajouté.")
 
   @need_server
   def do_egremove(self, arg):
     """Supprime les serveurs d'un groupe de la selection selon une regex
-    Usage : egremove <regex groupe>
+    Usage : egremove <regex groupe> [<regex groupe>...]
     Alias : egrm, egr"""
-    args = sorted(arg.split(" "))
-    no_action = True
-    for a in args:
-      for group in self.available["groups"][self.selected["file"]]:
-        if re.search(a, group):
-          self.selected["groups"].remove(group)
-          print("{} supprimé.".format(group))
-          no_action = False
-    if no_action:
+    try:
+      matched = match_names(arg.split(), self.selected["groups"])
+    except (re.error, ValueError) as e:
+      print("Expression invalide : {}".format(e))
+      return
+    for group in sorted(matched):
+      self.selected["groups"].remove(group)
+      print("{} supprimé.".format(group))
+    if not matched:
       print("Aucun groupe n'a pas été supprimé.")
 
   @need_server
   def do_eremove(self, arg):
-    """Supprime un ou plusieurs serveurs de la selection selon une regex
-    Usage : eremove <regex serveur>
+    """Supprime un ou plusieurs serveurs de la selection selon une regex ou un motif ansible
+    Usage : eremove <regex serveur|motif> [<regex serveur|motif>...]
     Alias : erm, er"""
-    args = sorted(arg.split(" "))
-    no_action = True
-    for a in args:
-      for server in self.available["servers"][self.selected["file"]]:
-        if re.search(a, server):
-          self.selected["servers"].remove(server)
-          print("{} supprimé.".format(server))
-          no_action = False
-    if no_action:
+    servers = {s: None for s in self.selected["servers"]}
+    members = self.available["members"].get(self.selected["file"], {})
+    try:
+      matched = self.match_servers(arg.split(), servers, members)
+    except (re.error, ValueError) as e:
+      print("Expression invalide : {}".format(e))
+      return
+    for server in sorted(matched):
+      self.selected["servers"].remove(server)
+      print("{} supprimé.".format(server))
+    if not matched:
       print("Aucun serveur n'a pas été supprimé.")
 
   @need_inventory
@@ -415,11 +3085,11 @@ class Ansiblator(cmd.Cmd):
     Usage : gadd <groupe>
     Alias : g"""
     args = sorted(arg.split(" "))
+    members = self.available["members"][self.selected["file"]]
     for a in args:
       if a in self.available["groups"][self.selected["file"]]:
-        print(self.selected["groups"])
         self.selected["groups"].add(a)
-        print("{} ajouté.".format(a))
+        print("{} ajouté ({} serveurs).".format(a, len(members.get(a, ()))))
       else:
         print("{} n'a pas été trouvé.".format(a))
 
@@ -448,70 +3118,194 @@ class Ansiblator(cmd.Cmd):
     else:
       print(self.all_help)
 
+  def do_history(self, arg):
+    """Interroge l'historique des déploiements du fichier d'inventaire sélectionné (ou de tous)
+    Usage : history [runs|tasks|hosts|regressions|tags] [<nombre>]"""
+    args = arg.split()
+    view = args[0] if args else "runs"
+    try:
+      limit = int(args[1]) if len(args) > 1 else 10
+    except ValueError:
+      print("'{}' n'est pas un nombre valide.".format(args[1]))
+      return
+    if view not in ("runs", "tasks", "hosts", "regressions", "tags"):
+      print("Usage : history [runs|tasks|hosts|regressions|tags] [<nombre>]")
+      return
+    if not os.path.isfile(history_db):
+      print("Aucun déploiement enregistré.")
+      return
+    scope, params = "", ()
+    if self.selected["file"]:
+      scope, params = "WHERE inventory = ?", (self.selected["file"],)
+    try:
+      with contextlib.closing(history_connect()) as db:
+        runs = db.execute("SELECT id FROM runs {} ORDER BY id DESC".format(scope), params).fetchall()
+        if not runs:
+          print("Aucun déploiement enregistré.")
+          return
+        ids = "({})".format(",".join(str(r[0]) for r in runs))
+        last = runs[0][0]
+        if view == "runs":
+          rows = db.execute(
+            "SELECT id, inventory, name, started, finished, returncode, interrupted, "
+            "(SELECT COUNT(DISTINCT host) FROM results WHERE run = runs.id) "
+            "FROM runs WHERE id IN {} ORDER BY id DESC LIMIT ?".format(ids),
+            (limit,),
+          ).fetchall()
+          for run_id, f, name, started, finished, code, interrupted, n_hosts in rows:
+            print(
+              "#{:<5} {}  {:<12} {:>8.1f}s  {} serveurs  code {}{}{}".format(
+                run_id,
+                time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(started or 0)),
+                f,
+                (finished or started or 0) - (started or 0),
+                n_hosts,
+                code,
+                " (interrompu)" if interrupted else "",
+                "  " + name if name else "",
+              )
+            )
+        elif view == "tasks":
+          rows = db.execute(
+            "SELECT task, COUNT(*), AVG(duration), MAX(duration) FROM tasks WHERE run IN {} "
+            "GROUP BY task ORDER BY AVG(duration) DESC LIMIT ?".format(ids),
+            (limit,),
+          ).fetchall()
+          print("{:>9}  {:>9}  {:>5}  tâche".format("moyenne", "max", "runs"))
+          for task, count, mean, longest in rows:
+            print("{:>8.2f}s  {:>8.2f}s  {:>5}  {}".format(mean, longest, count, task))
+        elif view == "hosts":
+          rows = db.execute(
+            "SELECT host, COUNT(DISTINCT run), SUM(duration) / COUNT(DISTINCT run), "
+            "SUM(status IN ('failed', 'unreachable')) FROM results WHERE run IN {} "
+            "GROUP BY host ORDER BY 3 DESC LIMIT ?".format(ids),
+            (limit,),
+          ).fetchall()
+          print("{:>9}  {:>5}  {:>7}  serveur".format("moyenne", "runs", "échecs"))
+          for host, count, mean, failures in rows:
+            print("{:>8.2f}s  {:>5}  {:>7}  {}".format(mean, count, failures, host))
+        elif view == "regressions":
+          rows = db.execute(
+            "SELECT t.task, t.duration, AVG(p.duration), COUNT(p.duration) FROM tasks t "
+            "JOIN tasks p ON p.task = t.task AND p.run IN {} AND p.run < t.run "
+            "WHERE t.run = ? GROUP BY t.task, t.seq".format(ids),
+            (last,),
+          ).fetchall()
+          regressions = sorted(
+            (r for r in rows if r[1] - r[2] >= history_regression_delay and r[1] >= r[2] * history_regression_ratio),
+            key=lambda r: r[2] - r[1],
+          )
+          if not regressions:
+            print("Aucune tâche du déploiement #{} n'est nettement plus lente qu'auparavant.".format(last))
+          for task, duration, mean, count in regressions[:limit]:
+            print(
+              "{:>8.2f}s  au lieu de {:>7.2f}s en moyenne ({} runs, x{:.1f})  {}".format(
+                duration, mean, count, duration / mean if mean else 0, task
+              )
+            )
+        else:
+          totals, runs_by_tag = {}, {}
+          for run_id, tags, duration in db.execute("SELECT run, tags, duration FROM tasks WHERE run IN {}".format(ids)):
+            for tag in (tags or "(aucun)").split(","):
+              totals[tag] = totals.get(tag, 0.0) + duration
+              runs_by_tag.setdefault(tag, set()).add(run_id)
+          print("{:>9}  {:>5}  tag".format("moyenne", "runs"))
+          by_mean = sorted(totals, key=lambda t: totals[t] / len(runs_by_tag[t]), reverse=True)
+          for tag in by_mean[:limit]:
+            print("{:>8.2f}s  {:>5}  {}".format(totals[tag] / len(runs_by_tag[tag]), len(runs_by_tag[tag]), tag))
+    except sqlite3.Error as e:
+      print("Impossible de lire l'historique {} : {}".format(history_db, e))
+
   def do_inventory(self, arg=""):
     """Affiche tout ou sélectionne l'un des fichiers d'inventaire disponible
     Usage : inventory [<nom de fichier d'inventaire>]
     Alias : inv, i"""
-    if arg in self.available["files"]:
+    inventory_files = self.inventories.list_files()
+    if arg in inventory_files:
       # self.do_reset()
       self.selected["file"] = arg
     elif not arg:
-      for inventory in sorted(self.available["files"]):
-        print(inventory)
+      width = max([len(f) for f in inventory_files], default=0)
+      for inventory in inventory_files:
+        print("{}  {}".format(inventory.ljust(width), self.inventories.status.get(inventory, "en attente")))
+      n_loading = len([f for f in inventory_files if self.inventories.is_loading(f)])
+      if n_loading:
+        print("Chargement en cours : {}/{} fichiers analysés".format(len(inventory_files) - n_loading, len(inventory_files)))
     else:
       print("'{}' n'a pas été trouvé. Voici les choix valides possibles :".format(arg))
       self.do_inventory()
 
   @need_inventory
   def do_list(self, arg):
-    """Liste les serveurs, groupes et variables
-    Usage : list
+    """Liste les serveurs, groupes et variables, éventuellement filtrés par des prédicats sur leurs variables
+    Usage : list [--columns <variable,...>] [<prédicat> [and <prédicat>...]]
     Alias : l"""
-    for host in self.available["servers"][self.selected["file"]]:
-      if "env" in self.available["servers"][self.selected["file"]][host]["vars"]:
-        env = self.available["servers"][self.selected["file"]][host]["vars"]["env"]
-      else:
-        env = ""
-      groups = ", ".join(sorted(self.available["servers"][self.selected["file"]][host]["groups"]))
-      print(host, "|", env, "|", groups)
+    try:
+      options, others = parse_options(arg, {"--columns": True})
+    except ValueError as e:
+      print(e)
+      return
+    columns = [c for c in options["--columns"].split(",") if c] if "--columns" in options else list_columns
+    try:
+      check_resident(columns)
+    except ValueError as e:
+      print(e)
+      return
+    servers = self.available["servers"][self.selected["file"]]
+    hosts = self.available["ordered"][self.selected["file"]]["servers"]
+    if others:
+      predicates = parse_predicates(" ".join(others))
+      if predicates is None:
+        print("Prédicat invalide : {}".format(" ".join(others)))
+        return
+      try:
+        matched = self.hosts_matching(predicates)
+      except ValueError as e:
+        print(e)
+        return
+      hosts = [h for h in hosts if h in matched] if len(matched) * 8 > len(hosts) else sortedn(matched)
+    # La sortie est écrite par lots plutôt qu'une ligne à la fois
+    batch = []
+    for host in hosts:
+      server = servers[host]
+      values = [str(server.vars.get(c, "")) for c in columns]
+      batch.append(" | ".join([host] + values + [", ".join(sorted(server.groups))]))
+      if len(batch) == 1000:
+        print("\n".join(batch))
+        batch = []
+    if batch:
+      print("\n".join(batch))
 
   def do_quit(self, arg):
     """Quitte le shell (et le programme)
     Usage : quit
     Alias : exit, q"""
+    if self.deploy and self.deploy.running():
+      print("Un déploiement est en cours. Utilisez 'abort' pour l'interrompre avant de quitter.")
+      return False
     return True
 
   def do_reload(self, arg=""):
     """Charge ou recharge les serveurs, groupes et tags disponibles
-    Usage : reload
+    Usage : reload [--force]
     """
-    self.available = {"files": {}, "servers": {}, "groups": {}, "tags": {}}
-
-    for f in os.listdir("inventory"):
-      f_fullpath = os.sep.join(("inventory", f))
-      if os.path.isfile(f_fullpath) and os.access(f_fullpath, os.R_OK):
-        servers, groups = self.parse_inventory_file(f_fullpath)
-        if len(servers) > 0:
-          tags = set()
-          playbook_main = yml_or_yaml("main")
-          tags_text = subprocess.run(
-            ("ansible-playbook", "-i", f_fullpath, "--list-tags", playbook_main),
-            stdout=subprocess.PIPE,
-            stderr=subprocess.DEVNULL,
-            universal_newlines=True,
-          ).stdout
-          for regex_tags in re.finditer("TASK TAGS: \[([\w\-, ]+)\]", tags_text):
-            tags.update(regex_tags.group(1).split(", "))
-          self.available["files"][f] = f_fullpath
-          self.available["servers"][f] = servers
-          self.available["groups"][f] = groups
-          self.available["tags"][f] = tags
+    self.inventories.reload(force="--force" in arg.split())
 
   @need_server
   def do_remove(self, arg):
-    """Supprime un serveur de la selection
-    Usage : remove <serveur>
+    """Supprime un serveur de la selection, ou les serveurs sélectionnés dont les variables vérifient les prédicats
+    Usage : remove <serveur|prédicat> [<serveur>...|and <prédicat>...]
     Alias : rm, r"""
+    predicates = parse_predicates(arg)
+    if predicates:
+      try:
+        removed = self.hosts_matching(predicates) & self.selected["servers"]
+      except ValueError as e:
+        print(e)
+        return
+      self.selected["servers"] -= removed
+      print("{} serveurs supprimés.".format(len(removed)))
+      return
     args = sorted(arg.split(" "))
     for a in args:
       if a in self.selected["servers"]:
@@ -523,21 +3317,27 @@ class Ansiblator(cmd.Cmd):
   def do_reset(self, arg=None):
     """Réinitialise la sélection de serveurs, groupes et tags
     Usage : reset"""
-    self.selected = {"file": "", "servers": set(), "groups": set(), "tags": set(), "skiptags": set()}
+    self.selected = {
+      "file": "",
+      "servers": SortedSet(),
+      "groups": SortedSet(),
+      "tags": SortedSet(),
+      "skiptags": SortedSet(),
+    }
 
   @need_inventory
   def do_show(self, arg=""):
     """Affiche les informations lié au déploiement en cours
     Usage : show
     Alias : s"""
+    members = self.available["members"][self.selected["file"]]
     servers_from_groups = {}
     for group in self.selected["groups"]:
-      for host in self.available["servers"][self.selected["file"]]:
-        if group in self.available["servers"][self.selected["file"]][host]["groups"]:
-          if host in servers_from_groups:
-            servers_from_groups[host].append(group)
-          else:
-            servers_from_groups[host] = [group]
+      for host in members.get(group, ()):
+        if host in servers_from_groups:
+          servers_from_groups[host].append(group)
+        else:
+          servers_from_groups[host] = [group]
     n_servers = len(self.selected["servers"])
     n_servers_from_groups = len(servers_from_groups)
     n_tags = len(self.selected["tags"])
@@ -545,7 +3345,7 @@ class Ansiblator(cmd.Cmd):
     print("Serveurs : ", end="")
     if n_servers > 0:
       print("")
-      for s in sortedn(self.selected["servers"]):
+      for s in self.selected["servers"]:
         if s not in servers_from_groups:
           print("  {}".format(s))
     else:
@@ -553,20 +3353,24 @@ class Ansiblator(cmd.Cmd):
     print("Serveurs depuis groupes : ", end="")
     if n_servers_from_groups > 0:
       print("")
-      for s in servers_from_groups:
-        print("  {} (depuis {})".format(s, ", ".join(sortedn(servers_from_groups[s]))))
+      for s in sortedn(servers_from_groups):
+        print("  {} (depuis {})".format(s, ", ".join(servers_from_groups[s])))
     else:
       print("❌")
     print("Tags : ", end="")
     if n_tags > 0:
-      print(", ".join(sortedn(self.selected["tags"])))
+      print(", ".join(self.selected["tags"]))
     else:
       print("❌")
     print("Skiptags : ", end="")
     if n_skiptags > 0:
-      print(", ".join(sortedn(self.selected["skiptags"])))
+      print(", ".join(self.selected["skiptags"]))
     else:
       print("❌")
+    if state_load(self.selected["file"]):
+      fingerprints = self.host_fingerprints(self.target_hosts())
+      changed = self.changed_hosts(fingerprints)
+      print("Modifiés depuis leur dernier déploiement : {} sur {}".format(len(changed), len(fingerprints)))
 
   @need_inventory
   def do_skiptag(self, arg):
@@ -574,7 +3378,7 @@ class Ansiblator(cmd.Cmd):
     Usage : skiptags [<tag> [<tag>...]]
     Alias : skiptag, st"""
     if not arg:
-      for tag in sortedn(self.available["tags"][self.selected["file"]]):
+      for tag in self.available["ordered"][self.selected["file"]]["tags"]:
         if tag in self.selected["skiptags"]:
           print(f"{tag} *")
         else:
@@ -590,13 +3394,81 @@ class Ansiblator(cmd.Cmd):
         else:
           print("{} n'a pas été trouvé.".format(a))
 
+  def do_stats(self, arg):
+    """Affiche la durée des chargements d'inventaire, des processus ansible et des commandes
+    Usage : stats [on|off|reset|export <fichier .json ou .jsonl>]"""
+    args = arg.split()
+    if args[:1] == ["on"] or args[:1] == ["off"]:
+      profiler.enabled = args[0] == "on"
+    elif args[:1] == ["reset"]:
+      profiler.records.clear()
+    elif args[:1] == ["export"] and len(args) == 2:
+      try:
+        print("{} mesures écrites dans {}.".format(profiler.export(args[1]), args[1]))
+      except OSError as e:
+        print("Impossible d'écrire {} : {}".format(args[1], e))
+      return
+    elif args:
+      print("Usage : stats [on|off|reset|export <fichier>]")
+      return
+    print("Mesures : {}".format("activées" if profiler.enabled else "désactivées (stats on ou ANSIBLATOR_PROFILE=1)"))
+    records = list(profiler.records)
+    if not records:
+      return
+
+    def mib(rss):
+      return "{:+.1f} Mo".format(rss / 1048576) if rss is not None else "-"
+
+    last = {}
+    for r in records:
+      if r["cat"] == "reload":
+        last.setdefault(r["args"]["file"], {})[r["name"]] = r
+    if last:
+      print("\nDernier chargement des fichiers d'inventaire :")
+      width = max(len(f) for f in last)
+      for f in sortedn(last):
+        print(
+          "  {:<{}}  {}".format(
+            f,
+            width,
+            "  ".join(
+              "{} {:.3f}s (cpu {:.3f}s, {})".format(name, r["wall"], r["cpu"], mib(r["rss"]))
+              for (name, r) in last[f].items()
+            ),
+          )
+        )
+    for cat, title in (("subprocess", "Processus ansible"), ("parse", "Analyse"), ("command", "Commandes")):
+      durations = {}
+      for r in records:
+        if r["cat"] == cat:
+          durations.setdefault(r["name"], []).append(r["wall"])
+      if not durations:
+        continue
+      print("\n{} :".format(title))
+      width = max(len(name) for name in durations)
+      for name in sorted(durations):
+        d = sorted(durations[name])
+        print(
+          "  {:<{}}  {:>5} appels  médiane {:8.1f} ms  p95 {:8.1f} ms  max {:8.1f} ms  total {:.3f}s".format(
+            name, width, len(d), d[len(d) // 2] * 1000, d[int(len(d) * 0.95)] * 1000, d[-1] * 1000, sum(d)
+          )
+        )
+
+  def do_status(self, arg):
+    """Affiche l'avancement du déploiement en cours ou du dernier déploiement
+    Usage : status"""
+    if not self.deploy:
+      print("Aucun déploiement n'a été lancé.")
+    else:
+      print(self.deploy.summary())
+
   @need_inventory
   def do_tags(self, arg):
     """Affiche la liste des tags ou applique un ou plusieurs tags lors du lancement du playbook
     Usage : tags [<tag> [<tag>...]]
     Alias : tag, t"""
     if not arg:
-      for tag in sortedn(self.available["tags"][self.selected["file"]]):
+      for tag in self.available["ordered"][self.selected["file"]]["tags"]:
         if tag in self.selected["tags"]:
           print(f"{tag} *")
         else:
@@ -612,6 +3484,35 @@ class Ansiblator(cmd.Cmd):
         else:
           print("{} n'a pas été trouvé.".format(a))
 
+  @need_inventory
+  def do_vars(self, arg):
+    """Affiche toutes les variables d'un serveur
+    Usage : vars <serveur>
+    Alias : v"""
+    host = arg.strip()
+    if host not in self.available["servers"][self.selected["file"]]:
+      print("{} n'a pas été trouvé.".format(host))
+      return
+    try:
+      hostvars = self.inventories.host_vars(self.selected["file"], host)
+    except (RuntimeError, ValueError) as e:
+      print("Impossible de lire les variables de {} : {}".format(host, e))
+      return
+    print(json.dumps(hostvars, indent=2, sort_keys=True, ensure_ascii=False, default=str))
+
+  def do_watch(self, arg):
+    """Active ou désactive le rechargement automatique des fichiers d'inventaire modifiés
+    Usage : watch [on|off]"""
+    arg = arg.strip().lower()
+    if arg == "on":
+      self.inventories.watch(watch_interval)
+    elif arg == "off":
+      self.inventories.unwatch()
+    elif arg:
+      print("'{}' n'est pas une valeur valide (on ou off).".format(arg))
+      return
+    print("Surveillance : {}".format("activée" if self.inventories.watcher else "désactivée"))
+
   def do_debug(self, arg):
     arg = arg.strip()
     if arg and hasattr(self, arg):
@@ -620,5 +3521,240 @@ class Ansiblator(cmd.Cmd):
       print("error!")
 
 
-# Appel la classe qui lance le shell interactif (et donc le programme)
-Ansiblator().cmdloop()
+# Définition de la classe redirigeant un flux standard vers la session du thread courant
+class StreamProxy:
+  """Remplace sys.stdout ou sys.stdin dans le démon : chaque thread de session lit et écrit sur la connexion de son
+  client, les autres threads utilisent le flux d'origine."""
+
+  def __init__(self, default):
+    self.default = default
+    self.local = threading.local()
+
+  def bind(self, stream):
+    """Associe le flux 'stream' au thread courant (None pour revenir au flux d'origine)"""
+    self.local.stream = stream
+
+  def __getattr__(self, name):
+    return getattr(getattr(self.local, "stream", None) or self.default, name)
+
+
+# Définition de la classe servant d'entrée et de sortie standard à une session du démon
+class SessionIO:
+  """Échange avec un client du démon des messages JSON, un par ligne :
+  - vers le client : {"out": texte}, {"prompt": invite}, {"matches": [...]}, {"exit": code}
+  - depuis le client : {"line": ligne ou null en fin de saisie}, {"complete": {"line": ..., "begidx": ..., "endidx": ...}}
+  """
+
+  def __init__(self, rfile, wfile):
+    self.rfile = rfile
+    self.wfile = wfile
+    self.buffer = ""
+    self.lock = threading.Lock()
+    self.session = None
+
+  def send(self, message):
+    """Envoi un message au client, la déconnexion du client est ignorée"""
+    with self.lock:
+      try:
+        self.wfile.write(json.dumps(message).encode() + b"\n")
+        self.wfile.flush()
+      except OSError:
+        pass
+
+  def write(self, text):
+    """Transmet au client les lignes complètes écrites, le reste est conservé jusqu'à la prochaine fin de ligne"""
+    self.buffer += text
+    if "\n" in self.buffer:
+      out, _, self.buffer = self.buffer.rpartition("\n")
+      self.send({"out": out + "\n"})
+    return len(text)
+
+  def flush(self):
+    pass
+
+  def readline(self):
+    """Demande une ligne au client, le texte en attente servant d'invite, et répond aux demandes de complétion reçues
+    entre-temps. Renvoi "" si le client s'est déconnecté.
+    """
+    prompt, self.buffer = self.buffer, ""
+    self.send({"prompt": prompt})
+    for raw in self.rfile:
+      try:
+        message = json.loads(raw)
+      except ValueError:
+        continue
+      if "complete" in message:
+        request = message["complete"]
+        try:
+          matches = self.session.complete_line(request["line"], request["begidx"], request["endidx"])
+        except Exception as e:
+          logging.debug("Complétion impossible : {}".format(e))
+          matches = []
+        self.send({"matches": matches})
+      elif "line" in message:
+        return "" if message["line"] is None else message["line"] + "\n"
+    return ""
+
+
+# Définition de la classe servant une session du shell à un client du démon
+class DaemonSession(socketserver.StreamRequestHandler):
+  """Lance un shell Ansiblator, avec sa propre sélection, sur les inventaires partagés du démon"""
+
+  def handle(self):
+    uid = self.peer_uid()
+    if uid is not None and uid != os.getuid():
+      logging.warning("Session refusée pour l'utilisateur {}.".format(uid))
+      return
+    io = SessionIO(self.rfile, self.wfile)
+    sys.stdout.bind(io)
+    sys.stdin.bind(io)
+    try:
+      shell = Ansiblator(self.server.inventories, stdin=io, stdout=io)
+      shell.use_rawinput = False
+      io.session = shell
+      shell.cmdloop()
+    except Exception as e:
+      logging.error("Session interrompue : {}".format(e))
+    finally:
+      io.send({"exit": 0})
+      sys.stdout.bind(None)
+      sys.stdin.bind(None)
+
+  def peer_uid(self):
+    """Renvoi l'uid du processus client, ou None si le système ne permet pas de le connaître"""
+    if not hasattr(socket, "SO_PEERCRED"):
+      return None
+    credentials = self.request.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    return struct.unpack("3i", credentials)[1]
+
+
+def serve(path):
+  """Lance le démon : les inventaires sont chargés et surveillés une seule fois et partagés par toutes les sessions des
+  clients connectés au socket 'path'.
+
+  Arguments :
+  path -- chemin du socket Unix
+  """
+  if os.path.exists(path):
+    if daemon_reachable(path):
+      logging.critical("Un démon écoute déjà sur {}.".format(path))
+      exit(1)
+    os.remove(path)
+  os.makedirs(os.path.dirname(path), exist_ok=True)
+  sys.stdout = StreamProxy(sys.stdout)
+  sys.stdin = StreamProxy(sys.stdin)
+  inventories = Inventories()
+  inventories.reload_in_background()
+  inventories.watch(watch_interval)
+  # Chaque session est un shell complet déployant avec les clés du propriétaire du démon : lui seul peut s'y connecter
+  umask = os.umask(0o077)
+  try:
+    server = socketserver.ThreadingUnixStreamServer(path, DaemonSession)
+  finally:
+    os.umask(umask)
+  server.daemon_threads = True
+  server.inventories = inventories
+  os.chmod(path, 0o600)
+  signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+  logging.info("Démon à l'écoute sur {}".format(path))
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+  finally:
+    server.server_close()
+    inventories.close()
+    os.remove(path)
+
+
+def daemon_reachable(path):
+  """Indique si un démon répond sur le socket 'path'"""
+  try:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+      sock.connect(path)
+    return True
+  except OSError:
+    return False
+
+
+def run_client(path):
+  """Ouvre une session sur le démon écoutant sur le socket 'path'. Renvoi le code de sortie de la session ou None si
+  aucun démon n'est joignable.
+
+  Arguments :
+  path -- chemin du socket Unix
+  """
+  sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+  try:
+    sock.connect(path)
+  except OSError:
+    sock.close()
+    return None
+  rfile, wfile = sock.makefile("rb"), sock.makefile("wb")
+  messages = queue.Queue()
+
+  def send(message):
+    wfile.write(json.dumps(message).encode() + b"\n")
+    wfile.flush()
+
+  def receive():
+    # Les sorties sont affichées dès leur réception, même pendant la saisie d'une commande
+    for raw in rfile:
+      message = json.loads(raw)
+      if "out" in message:
+        sys.stdout.write(message["out"])
+        sys.stdout.flush()
+      else:
+        messages.put(message)
+    messages.put({"exit": 1})
+
+  matches = []
+
+  def complete(text, state):
+    if state == 0:
+      line = readline.get_line_buffer()
+      send({"complete": {"line": line, "begidx": readline.get_begidx(), "endidx": readline.get_endidx()}})
+      matches[:] = messages.get().get("matches", [])
+    return matches[state] if state < len(matches) else None
+
+  readline.set_completer_delims(" \t\n")
+  readline.set_completer(complete)
+  readline.parse_and_bind("tab: complete")
+  threading.Thread(target=receive, daemon=True).start()
+  try:
+    while True:
+      message = messages.get()
+      if "exit" in message:
+        return message["exit"]
+      if "prompt" in message:
+        try:
+          send({"line": input(message["prompt"])})
+        except EOFError:
+          print()
+          send({"line": None})
+  except (KeyboardInterrupt, OSError):
+    return 1
+  finally:
+    sock.close()
+
+
+def main():
+  """Lance le shell. Avec --daemon, lance le démon partageant les inventaires entre plusieurs sessions ; sans
+  --standalone, une session est ouverte sur le démon s'il est joignable.
+  """
+  args = sys.argv[1:]
+  if "--daemon" not in args and "--standalone" not in args:
+    code = run_client(daemon_socket)
+    if code is not None:
+      sys.exit(code)
+  check_prerequisites()
+  setup_roles()
+  if "--daemon" in args:
+    serve(daemon_socket)
+  else:
+    Ansiblator().cmdloop()
+
+
+# Appel la fonction qui lance le shell interactif (et donc le programme)
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""Génère un projet ansible synthétique (playbook, rôles taggés et inventaires) utilisé par les benchmarks.
+
+Les fichiers d'inventaire contiennent directement la sortie de 'ansible-inventory --list' : ils sont lus par le faux
+ansible-inventory du dossier bench/bin.
+"""
+
+import argparse
+import json
+import os
+import random
+
+
+def group_tree(depth, fanout):
+  """Renvoi la liste des groupes et le dictionnaire des enfants de chaque groupe d'un arbre de profondeur 'depth' dont
+  chaque groupe a 'fanout' enfants. Le groupe 'all' est la racine.
+
+  Arguments :
+  depth -- nombre de niveaux de groupes sous 'all'
+  fanout -- nombre d'enfants de chaque groupe
+  """
+  children = {"all": []}
+  level = ["all"]
+  for d in range(depth):
+    next_level = []
+    for parent in level:
+      for i in range(fanout):
+        name = "g{}_{}".format(d, len(next_level))
+        children[parent].append(name)
+        children[name] = []
+        next_level.append(name)
+    level = next_level
+  return children, level
+
+
+def generate_inventory(hosts, depth, fanout, var_size, seed=0):
+  """Renvoi un inventaire au format de 'ansible-inventory --list'
+
+  Arguments :
+  hosts -- nombre de serveurs
+  depth -- profondeur de l'arbre des groupes
+  fanout -- nombre d'enfants de chaque groupe
+  var_size -- taille approximative en octets des variables de chaque serveur
+  seed -- graine du générateur aléatoire
+  """
+  rnd = random.Random(seed)
+  children, leaves = group_tree(depth, fanout)
+  members = {g: [] for g in children}
+  extra = ["role_{}".format(r) for r in ("web", "db", "cache", "proxy", "batch")]
+  for g in extra:
+    members[g] = []
+    children["all"].append(g)
+    children[g] = []
+  hostvars = {}
+  width = len(str(hosts))
+  for i in range(hosts):
+    name = "{}-{:0{}d}.{}".format(rnd.choice(("web", "db", "app", "cache")), i, width, rnd.choice(("par1", "ams2")))
+    members[leaves[i % len(leaves)]].append(name)
+    members[rnd.choice(extra)].append(name)
+    hostvars[name] = {
+      "env": rnd.choice(("prod", "staging", "dev")),
+      "datacenter": name.rsplit(".", 1)[1],
+      "os_version": rnd.choice((10, 11, 12)),
+      "ansible_host": "10.{}.{}.{}".format(i >> 16 & 255, i >> 8 & 255, i & 255),
+      "payload": "x" * max(0, var_size - 100),
+    }
+  inventory = {"_meta": {"hostvars": hostvars}}
+  for g in children:
+    group = {}
+    if children[g]:
+      group["children"] = children[g]
+    if members[g]:
+      group["hosts"] = members[g]
+    inventory[g] = group
+  inventory["all"]["children"].append("ungrouped")
+  inventory["ungrouped"] = {}
+  return inventory
+
+
+def write_project(path, inventories, roles=8, tasks=10):
+  """Écrit un projet ansible dans le dossier 'path' : main.yml, des rôles taggés et les fichiers d'inventaire
+
+  Arguments :
+  path -- dossier du projet
+  inventories -- dictionnaire nom du fichier -> inventaire renvoyé par generate_inventory()
+  roles -- nombre de rôles
+  tasks -- nombre de tâches par rôle
+  """
+  os.makedirs(os.path.join(path, "inventory"), exist_ok=True)
+  with open(os.path.join(path, "main.yml"), "w") as fd:
+    fd.write("- hosts: all\n  tags: [base]\n  roles:\n")
+    for r in range(roles):
+      fd.write("    - role: role{}\n      tags: role{}\n".format(r, r))
+  for r in range(roles):
+    os.makedirs(os.path.join(path, "roles", "role{}".format(r), "tasks"), exist_ok=True)
+    with open(os.path.join(path, "roles", "role{}".format(r), "tasks", "main.yml"), "w") as fd:
+      for t in range(tasks):
+        fd.write("- name: task {}\n  debug: msg={}\n  tags: [role{}_t{}]\n".format(t, t, r, t % 3))
+  for name, inventory in inventories.items():
+    with open(os.path.join(path, "inventory", name), "w") as fd:
+      json.dump(inventory, fd)
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument("path", help="dossier du projet à créer")
+  parser.add_argument("--hosts", type=int, default=1000)
+  parser.add_argument("--depth", type=int, default=3)
+  parser.add_argument("--fanout", type=int, default=4)
+  parser.add_argument("--var-size", type=int, default=200)
+  parser.add_argument("--files", type=int, default=1, help="nombre de fichiers d'inventaire")
+  args = parser.parse_args()
+  write_project(
+    args.path,
+    {
+      "inv{}".format(i): generate_inventory(args.hosts, args.depth, args.fanout, args.var_size, seed=i)
+      for i in range(args.files)
+    },
+  )
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""Mesure les performances d'ansiblator sur des inventaires synthétiques et enregistre les résultats en JSON.
+
+Le projet généré est analysé avec les remplaçants d'ansible du dossier bench/bin : aucune installation d'ansible ni accès
+réseau n'est nécessaire. Deux fichiers de résultats peuvent ensuite être comparés avec --compare.
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import logging
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import generate
+
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+app_path = os.path.join(os.path.dirname(bench_dir), "app.py")
+
+
+def measure(func, repeat):
+  """Renvoi les statistiques (en secondes) de 'repeat' appels de 'func'
+
+  Arguments :
+  func -- fonction sans argument à chronométrer
+  repeat -- nombre d'appels
+  """
+  times = []
+  for _ in range(repeat):
+    start = time.perf_counter()
+    func()
+    times.append(time.perf_counter() - start)
+  return {
+    "min": min(times),
+    "median": statistics.median(times),
+    "mean": statistics.fmean(times),
+    "max": max(times),
+    "repeat": repeat,
+  }
+
+
+def load_app():
+  """Importe app.py sans lancer le shell"""
+  spec = importlib.util.spec_from_file_location("ansiblator", app_path)
+  app = importlib.util.module_from_spec(spec)
+  spec.loader.exec_module(app)
+  logging.getLogger().setLevel(logging.WARNING)
+  return app
+
+
+def group_parents(inventory):
+  """Renvoi le dictionnaire groupe -> groupes parents d'un inventaire au format de 'ansible-inventory --list'"""
+  parents = {}
+  for name, group in inventory.items():
+    if name == "_meta":
+      continue
+    parents.setdefault(name, [])
+    for child in group.get("children", ()):
+      parents.setdefault(child, []).append(name)
+  return parents
+
+
+def startup(args, stdin):
+  """Lance app.py dans le projet courant et lui envoi les commandes 'stdin'"""
+  subprocess.run(
+    [sys.executable, app_path, "--standalone"] + args,
+    input=stdin.encode(),
+    stdout=subprocess.DEVNULL,
+    stderr=subprocess.DEVNULL,
+    check=True,
+  )
+
+
+def run_size(app, path, hosts, args):
+  """Renvoi les mesures d'un projet de 'hosts' serveurs créé dans le dossier 'path'
+
+  Arguments :
+  app -- module app.py importé
+  path -- dossier du projet
+  hosts -- nombre de serveurs
+  args -- options de la ligne de commande
+  """
+  inventory = generate.generate_inventory(hosts, args.depth, args.fanout, args.var_size)
+  generate.write_project(path, {"inv": inventory})
+  os.chdir(path)
+  inventory_path = os.path.join("inventory", "inv")
+  names = list(inventory["_meta"]["hostvars"])
+  parents = group_parents(inventory)
+  rnd = random.Random(0)
+  results = {}
+
+  def cold_start():
+    shutil.rmtree(os.path.join(".ansiblator", "cache"), ignore_errors=True)
+    startup([], "inventory inv\nshow\nquit\n")
+
+  results["startup_prompt"] = measure(lambda: startup([], "quit\n"), args.repeat)
+  results["startup_cold"] = measure(cold_start, args.repeat)
+  results["startup_warm"] = measure(lambda: startup([], "inventory inv\nshow\nquit\n"), args.repeat)
+
+  with contextlib.redirect_stdout(io.StringIO()):
+    shell = app.Ansiblator()
+    shell.inventories.wait("inv")
+
+    def reload():
+      shell.do_reload("--force")
+      shell.inventories.wait("inv")
+
+    results["do_reload"] = measure(reload, args.repeat)
+    results["parse_inventory_file"] = measure(
+      lambda: shell.inventories.parse_inventory_file(inventory_path), args.repeat
+    )
+    results["group_closure"] = measure(lambda: app.group_closure(parents), args.repeat)
+
+    shuffled = rnd.sample(names, len(names))
+    results["sortedn"] = measure(lambda: app.sortedn(shuffled), args.repeat)
+
+    servers = shell.available["servers"]["inv"]
+    members = shell.available["members"]["inv"]
+    selections = {"select_regex": ["~^web-.*par1$", "db-*"], "select_pattern": ["g1_*:&role_web:!role_db"]}
+    for name, patterns in selections.items():
+      # Une sélection vide ne mesurerait que l'analyse du motif
+      if not shell.match_servers(patterns, servers, members):
+        raise RuntimeError("La sélection {} ({}) ne désigne aucun serveur".format(name, " ".join(patterns)))
+      results[name] = measure(lambda: shell.match_servers(patterns, servers, members), args.repeat)
+
+    shell.onecmd("inventory inv")
+    groups = sorted(g for g in shell.available["groups"]["inv"] if g.startswith("g{}_".format(args.depth - 1)))
+    shell.selected["groups"] = app.SortedSet(rnd.sample(groups, max(1, len(groups) // 4)))
+    shell.selected["servers"] = app.SortedSet(rnd.sample(names, max(1, len(names) // 10)))
+    results["do_show"] = measure(shell.do_show, args.repeat)
+    results["deploy_command"] = measure(shell.deploy_command, args.repeat)
+    shell.postloop()
+  os.chdir(bench_dir)
+  return results
+
+
+def revision():
+  """Renvoi la révision git du dépôt ou None"""
+  try:
+    return subprocess.run(
+      ["git", "describe", "--always", "--dirty"], cwd=bench_dir, capture_output=True, text=True, check=True
+    ).stdout.strip()
+  except (OSError, subprocess.CalledProcessError):
+    return None
+
+
+def compare(old_path, new_path):
+  """Affiche pour chaque mesure commune aux deux fichiers de résultats le rapport des médianes"""
+  with open(old_path) as fd:
+    old = json.load(fd)
+  with open(new_path) as fd:
+    new = json.load(fd)
+  print("{} ({}) -> {} ({})".format(old_path, old.get("revision"), new_path, new.get("revision")))
+  for size in sorted(set(old["results"]) & set(new["results"]), key=int):
+    print("\n{} serveurs".format(size))
+    for name, result in new["results"][size].items():
+      if name not in old["results"][size]:
+        continue
+      before, after = old["results"][size][name]["median"], result["median"]
+      print("  {:<22} {:>10.4f}s {:>10.4f}s  x{:.2f}".format(name, before, after, before / after if after else 0))
+
+
+def main():
+  parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+  parser.add_argument("--hosts", default="1000,10000", help="tailles d'inventaire, séparées par des virgules")
+  parser.add_argument("--depth", type=int, default=3, help="profondeur de l'arbre des groupes")
+  parser.add_argument("--fanout", type=int, default=4, help="nombre d'enfants de chaque groupe")
+  parser.add_argument("--var-size", type=int, default=200, help="taille des variables de chaque serveur en octets")
+  parser.add_argument("--repeat", type=int, default=5, help="nombre de répétitions de chaque mesure")
+  parser.add_argument("--output", help="fichier de résultats JSON (par défaut sur la sortie standard)")
+  parser.add_argument("--compare", nargs=2, metavar=("AVANT", "APRES"), help="compare deux fichiers de résultats")
+  args = parser.parse_args()
+  if args.compare:
+    compare(*args.compare)
+    return
+
+  os.environ["PATH"] = os.path.join(bench_dir, "bin") + os.pathsep + os.environ["PATH"]
+  os.environ["ANSIBLATOR_WATCH"] = "0"
+  root = tempfile.mkdtemp(prefix="ansiblator-bench.")
+  try:
+    results = {}
+    for hosts in (int(h) for h in args.hosts.split(",")):
+      path = os.path.join(root, str(hosts))
+      os.makedirs(path)
+      os.chdir(path)
+      # app.py lit sa configuration et ses chemins relatifs depuis le dossier du projet
+      generate.write_project(path, {})
+      app = load_app()
+      results[str(hosts)] = run_size(app, path, hosts, args)
+  finally:
+    os.chdir(bench_dir)
+    shutil.rmtree(root, ignore_errors=True)
+
+  report = {
+    "revision": revision(),
+    "date": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    "python": platform.python_version(),
+    "platform": platform.platform(),
+    "params": {k: v for k, v in vars(args).items() if k not in ("output", "compare")},
+    "results": results,
+  }
+  if args.output:
+    with open(args.output, "w") as fd:
+      json.dump(report, fd, indent=2)
+  else:
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+
+if __name__ == "__main__":
+  main()
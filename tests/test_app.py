@@ -0,0 +1,127 @@
+import importlib.util
+import io
+import json
+import os
+import random
+import shutil
+
+import pytest
+
+app_path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+
+@pytest.fixture(scope="module")
+def app():
+  spec = importlib.util.spec_from_file_location("ansiblator", app_path)
+  module = importlib.util.module_from_spec(spec)
+  spec.loader.exec_module(module)
+  return module
+
+
+def test_backends_same_digests(app, tmp_path, monkeypatch):
+  pytest.importorskip("ansible")
+  if not shutil.which("ansible-inventory"):
+    pytest.skip("ansible-inventory introuvable")
+  monkeypatch.chdir(tmp_path)
+  (tmp_path / "inv").write_text(
+    "[web]\nweb1 env=prod\nweb2 env=dev\n\n[db]\ndb1\n\n[prod:children]\nweb\ndb\n\n[prod:vars]\ndatacenter=par1\n"
+  )
+  inventories = app.Inventories()
+  subprocess_servers = inventories.parse_inventory_subprocess("inv")[0]
+  python_servers = inventories.parse_inventory_in_process("inv")[0]
+  assert inventories.ansible_api
+  assert {h: s.digest for h, s in python_servers.items()} == {h: s.digest for h, s in subprocess_servers.items()}
+
+
+def test_expand_range(app):
+  assert app.expand_range("web[01:03]") == ["web01", "web02", "web03"]
+  assert app.expand_range("db[a:c]-[1:3:2]") == ["dba-1", "dba-3", "dbb-1", "dbb-3", "dbc-1", "dbc-3"]
+  with pytest.raises(ValueError):
+    app.expand_range("web[1:3:0]")
+  with pytest.raises(ValueError):
+    app.expand_range("web[0:{}]".format(app.range_max))
+
+
+def test_select_regex_pattern(app):
+  servers = dict.fromkeys(("web1.par1", "web2.ams2", "db1.par1"))
+  members = {"web": {"web1.par1", "web2.ams2"}}
+  assert app.is_host_pattern("~^web")
+  assert app.select_hosts("~^web.*par1$", servers, members) == {"web1.par1"}
+
+
+def test_select_exclusions_only(app):
+  servers = dict.fromkeys(("web1", "web2", "canary1"))
+  members = {"canary": {"canary1"}, "web": {"web1", "web2"}}
+  assert app.select_hosts("!canary", servers, members) == {"web1", "web2"}
+  assert app.select_hosts("&web:!web2", servers, members) == {"web1"}
+  assert app.select_hosts("!nothing", servers, members) == set(servers)
+
+
+def test_imported_playbook_changes_hosts(app, tmp_path, monkeypatch):
+  monkeypatch.chdir(tmp_path)
+  (tmp_path / "playbooks").mkdir()
+  (tmp_path / "main.yml").write_text("- import_playbook: playbooks/web.yml\n")
+  (tmp_path / "playbooks" / "web.yml").write_text("- hosts: all\n  tasks:\n    - debug: msg=1\n")
+  shell = app.Ansiblator(inventories=app.Inventories())
+  shell.available["servers"]["inv"] = {"web1": app.Host(frozenset(), {}, b"digest")}
+  fingerprints = shell.host_fingerprints({"web1"}, "inv")
+  app.state_update("inv", fingerprints)
+  assert not shell.changed_hosts(shell.host_fingerprints({"web1"}, "inv"), "inv")
+  (tmp_path / "playbooks" / "web.yml").write_text("- hosts: all\n  tasks:\n    - debug: msg=2\n      tags: web\n")
+  assert shell.changed_hosts(shell.host_fingerprints({"web1"}, "inv"), "inv") == {"web1"}
+
+
+def test_json_stream_chunks(app):
+  document = {"a": 12.5, "b": 3.25, "c": [1e10, -7, 0.5e-3, True, None], "d": {"e": "xéy", "f": 100}}
+  raw = json.dumps(document).encode()
+  for chunk_size in range(1, 12):
+    stream = app.JsonStream(io.BytesIO(raw), chunk_size)
+    assert {key: stream.value() for key in stream.items()} == json.loads(raw)
+
+
+def test_limit_cover(app):
+  rnd = random.Random(0)
+  servers = ["host{}".format(i) for i in range(60)]
+  members = {"g{}".format(g): set(rnd.sample(servers, rnd.randint(1, 30))) for g in range(8)}
+  for _ in range(50):
+    hosts = set(rnd.sample(servers, rnd.randint(1, 60)))
+    terms = app.limit_cover(hosts, members, set(servers))
+    covered, excluded = set(), set()
+    for term in terms:
+      if term.startswith("!"):
+        excluded.add(term[1:])
+      elif term == "all":
+        covered |= set(servers)
+      else:
+        covered |= members.get(term, {term})
+    assert covered - excluded == hosts
+    assert len(terms) <= len(hosts)
+
+
+def test_parse_predicates(app):
+  assert app.parse_predicates("env=prod and dc in (par1, 'par2')") == [
+    ("env", "=", ["prod"]),
+    ("dc", "in", ["par1", "par2"]),
+  ]
+  assert app.parse_predicates("os_version >= 11 env != dev") == [("os_version", ">=", ["11"]), ("env", "!=", ["dev"])]
+  assert app.parse_predicates("web1.par1 web2.par1") is None
+  assert app.parse_predicates("env=prod web1") is None
+
+
+def test_var_index_match(app):
+  servers = {
+    "a": app.Host(frozenset(), {"env": "prod", "version": 9}, b""),
+    "b": app.Host(frozenset(), {"env": "dev", "version": 10}, b""),
+    "c": app.Host(frozenset(), {"env": "staging", "version": 11}, b""),
+    "d": app.Host(frozenset(), {}, b""),
+  }
+  index = app.build_var_index(servers, ["env", "version"])
+  assert index["env"].match("=", ["prod"]) == {"a"}
+  assert index["env"].match("!=", ["prod"]) == {"b", "c"}
+  assert index["env"].match("in", ["dev", "staging", "test"]) == {"b", "c"}
+  # Comparaison numérique : 9 < 10, alors que "9" > "10" en texte
+  assert index["version"].match(">=", ["10"]) == {"b", "c"}
+  assert index["version"].match("<", ["10"]) == {"a"}
+  # Comparaison textuelle
+  assert index["env"].match(">=", ["prod"]) == {"a", "c"}
+  assert index["env"].match("<", ["prod"]) == {"b"}